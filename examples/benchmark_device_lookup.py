@@ -0,0 +1,73 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from centrometal_web_boiler.WebBoilerDeviceCollection import WebBoilerDeviceCollection
+from centrometal_web_boiler.const import WEB_BOILER_STOMP_DEVICE_TOPIC
+
+
+def create_installations(count):
+    installations = []
+    for i in range(0, count):
+        installations.append({
+            "value": 1000 + i,
+            "label": f"SN{i:06d}",
+            "place": "Place",
+            "address": "Address",
+            "type": "peltec",
+            "product": "PelTec",
+        })
+    return installations
+
+
+def create_frame(serial, body):
+    return {
+        "cmd": "MESSAGE",
+        "headers": {
+            "subscription": "sub-1",
+            "destination": WEB_BOILER_STOMP_DEVICE_TOPIC + "peltec." + serial,
+        },
+        "body": body,
+    }
+
+
+async def on_parameter_updated(device, param, create = False):
+    pass
+
+
+async def measure(device_count, frame_count):
+    collection = WebBoilerDeviceCollection("benchmark", on_parameter_updated)
+    collection.parse_installations(create_installations(device_count))
+    for device in collection.values():
+        device.create_parameter("B_Tak1_1", 0)
+    # always hit the last created device, this was the worst case for linear scan
+    serial = f"SN{device_count - 1:06d}"
+    frame = create_frame(serial, json.dumps({"B_Tak1_1": 55}))
+    start = time.perf_counter()
+    for i in range(0, frame_count):
+        await collection.parse_real_time_frame(frame)
+    frame_time = (time.perf_counter() - start) / frame_count
+    start = time.perf_counter()
+    for i in range(0, frame_count):
+        collection.get_device_by_id(1000 + device_count - 1)
+    id_time = (time.perf_counter() - start) / frame_count
+    return frame_time, id_time
+
+
+async def main(frames):
+    print(f"{'devices':>8} {'frame [us]':>12} {'by id [us]':>12}")
+    for device_count in [1, 10, 100, 1000]:
+        frame_time, id_time = await measure(device_count, frames)
+        print(f"{device_count:>8} {frame_time * 1e6:>12.2f} {id_time * 1e6:>12.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='WebBoiler device lookup benchmark.')
+    parser.add_argument('--frames', type=int, default=20000, help='Frames per device count')
+    args = parser.parse_args()
+    asyncio.run(main(args.frames))
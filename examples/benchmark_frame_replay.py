@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from centrometal_web_boiler.WebBoilerDeviceCollection import WebBoilerDeviceCollection
+from centrometal_web_boiler.WebBoilerFrameRecorder import WebBoilerFrameRecorder, WebBoilerFrameReplay
+from centrometal_web_boiler.const import WEB_BOILER_STOMP_DEVICE_TOPIC
+
+
+def create_installations(count):
+    return [{
+        "value": 1000 + i,
+        "label": f"SN{i:06d}",
+        "place": "Place",
+        "address": "Address",
+        "type": "peltec",
+        "product": "PelTec",
+    } for i in range(0, count)]
+
+
+def create_raw_frame(serial, index, body):
+    destination = WEB_BOILER_STOMP_DEVICE_TOPIC + "peltec." + serial
+    return (
+        "MESSAGE\n"
+        "subscription:sub-1\n"
+        f"destination:{destination}\n"
+        f"message-id:T_sub-1@@session-benchmark@@{index}\n"
+        "redelivered:false\n"
+        "content-type:application/json\n"
+        f"content-length:{len(body.encode())}\n"
+        "\n"
+        f"{body}\x00"
+    )
+
+
+async def create_collection(args):
+    collection = WebBoilerDeviceCollection("benchmark", compact_parameters=True)
+    collection.parse_installations(create_installations(args.devices))
+    for device in collection.values():
+        for j in range(0, args.parameters):
+            device.create_parameter(f"PDT {j}", "0")
+    return collection
+
+
+async def record(path, args):
+    # synthetic capture: frames arrive args.rate per second, timestamps are written explicitly
+    collection = await create_collection(args)
+    recorder = WebBoilerFrameRecorder(path, max_bytes=args.max_bytes, compress=args.compress)
+    recorder.record_snapshot("benchmark", collection.create_snapshot())
+    serials = list(collection.keys())
+    timestamp = time.time()
+    start = time.perf_counter()
+    for index in range(0, args.frames):
+        serial = random.choice(serials)
+        body = json.dumps({f"PDT {random.randrange(args.parameters)}": str(random.randint(0, 1000)) for _ in range(0, 5)})
+        recorder.record(create_raw_frame(serial, index, body), timestamp + index / args.rate)
+    recorder.close()
+    await recorder.wait_compressed()
+    elapsed = time.perf_counter() - start
+    files = recorder.get_files()
+    size = sum(os.path.getsize(filename) for filename in files)
+    print(f"  recorded {args.frames} frames in {elapsed * 1000:.0f} ms, {len(files)} files, {size / 1024 / 1024:.1f} MiB on disk")
+    return files
+
+
+async def replay(files, speed, label):
+    # collection starts empty, devices come from snapshot recorded in the capture
+    collection = WebBoilerDeviceCollection("replay", compact_parameters=True)
+    stats = await WebBoilerFrameReplay(collection, speed).replay(files)
+    print(
+        f"    {label:<12} {stats['messages']:>9} messages {stats['elapsed']:>8.2f} s  "
+        f"{stats['messages_per_second']:>10.0f} msg/s {stats['megabytes_per_second']:>7.1f} MiB/s  errors {stats['errors']}"
+    )
+
+
+async def main(args):
+    with tempfile.TemporaryDirectory() as path:
+        files = await record(path, args)
+        await replay(files, None, "max speed")
+        for speed in args.speed:
+            await replay(files, speed, f"{speed}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Frame recorder and replay benchmark.')
+    parser.add_argument('--devices', type=int, default=100, help='Device count')
+    parser.add_argument('--parameters', type=int, default=200, help='Parameters per device')
+    parser.add_argument('--frames', type=int, default=100000, help='Recorded frames')
+    parser.add_argument('--rate', type=float, default=100, help='Recorded frames per second')
+    parser.add_argument('--max-bytes', type=int, default=16 * 1024 * 1024, help='Rotate file above this size')
+    parser.add_argument('--compress', action='store_true', help='Gzip rotated files')
+    parser.add_argument('--speed', type=float, nargs='*', default=[], help='Paced replay speeds, e.g. 1000')
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import tracemalloc
+
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from centrometal_web_boiler.WebBoilerDeviceCollection import WebBoilerDeviceCollection
+from centrometal_web_boiler.JsonStreamParser import JsonStreamParser, json_loads, JSON_BACKEND
+
+
+def create_installations(count):
+    return [{
+        "value": 1000 + i,
+        "label": f"SN{i:06d}",
+        "place": "Place",
+        "address": "Address",
+        "type": "peltec",
+        "product": "PelTec",
+    } for i in range(0, count)]
+
+
+def create_installation_status_all(device_count, parameter_count):
+    timestamps = ["2024-01-01 10:00:00", "2024-01-01 10:00:05", "2024-01-01 10:01:00"]
+    result = dict()
+    for i in range(0, device_count):
+        result[str(1000 + i)] = {
+            "installation": {"country": "Croatia", "countryCode": "HR"},
+            "params": {
+                f"PRD {j}": {"v": str(random.randint(0, 1000)), "ut": random.choice(timestamps)}
+                for j in range(0, parameter_count)
+            },
+        }
+    return json.dumps(result).encode()
+
+
+async def ingest_text(body, device_count, chunk_size):
+    # previous path: response.text() and json.loads, then walk whole dict
+    collection = WebBoilerDeviceCollection("benchmark")
+    collection.parse_installations(create_installations(device_count))
+    await collection.parse_installation_statuses(json.loads(body.decode()))
+    return collection
+
+
+async def ingest_backend(body, device_count, chunk_size):
+    collection = WebBoilerDeviceCollection("benchmark")
+    collection.parse_installations(create_installations(device_count))
+    await collection.parse_installation_statuses(json_loads(body))
+    return collection
+
+
+async def ingest_stream(body, device_count, chunk_size):
+    collection = WebBoilerDeviceCollection("benchmark")
+    collection.parse_installations(create_installations(device_count))
+    parser = JsonStreamParser()
+    for position in range(0, len(body), chunk_size):
+        for device_id, value in parser.feed(body[position:position + chunk_size]):
+            await collection.parse_installation_status(device_id, value)
+    return collection
+
+
+async def decode_text(body, device_count, chunk_size):
+    return json.loads(body.decode())
+
+
+async def decode_backend(body, device_count, chunk_size):
+    return json_loads(body)
+
+
+async def decode_stream(body, device_count, chunk_size):
+    parser = JsonStreamParser()
+    count = 0
+    for position in range(0, len(body), chunk_size):
+        count += len(parser.feed(body[position:position + chunk_size]))
+    return count
+
+
+async def measure(name, ingest, body, device_count, chunk_size, runs):
+    best = None
+    for _ in range(0, runs):
+        start = time.perf_counter()
+        await ingest(body, device_count, chunk_size)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    collection = await ingest(body, device_count, chunk_size)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # retained collection is the same for every path, difference of peak and current is parsing overhead
+    print(f"    {name:<24} {best * 1000:>10.1f} ms  peak {peak / 1024:>10.0f} KiB  transient {(peak - current) / 1024:>10.0f} KiB")
+    return collection
+
+
+async def main(args):
+    print(f"  JSON backend: {JSON_BACKEND}")
+    for device_count in args.devices:
+        body = create_installation_status_all(device_count, args.parameters)
+        print(f"  devices {device_count:>5}  parameters {args.parameters}  response {len(body) / 1024:.0f} KiB")
+        print("   decode only")
+        await measure("text + json.loads", decode_text, body, device_count, args.chunk_size, args.runs)
+        await measure(f"bytes + {JSON_BACKEND}", decode_backend, body, device_count, args.chunk_size, args.runs)
+        await measure(f"stream {args.chunk_size // 1024} KiB chunks", decode_stream, body, device_count, args.chunk_size, args.runs)
+        print("   decode + parse_installation_status")
+        expected = await measure("text + json.loads", ingest_text, body, device_count, args.chunk_size, args.runs)
+        await measure(f"bytes + {JSON_BACKEND}", ingest_backend, body, device_count, args.chunk_size, args.runs)
+        streamed = await measure(f"stream {args.chunk_size // 1024} KiB chunks", ingest_stream, body, device_count, args.chunk_size, args.runs)
+        for serial, device in expected.items():
+            for name, parameter in device["parameters"].items():
+                if streamed[serial]["parameters"][name]["value"] != parameter["value"]:
+                    raise Exception(f"Streamed value differs for {serial} {name}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='installation-status-all ingestion benchmark.')
+    parser.add_argument('--devices', type=int, nargs='+', default=[1, 10, 100, 1000], help='Device counts')
+    parser.add_argument('--parameters', type=int, default=200, help='Parameters per device')
+    parser.add_argument('--chunk-size', type=int, default=65536, help='Stream chunk size in bytes')
+    parser.add_argument('--runs', type=int, default=3, help='Timed runs, best is reported')
+    args = parser.parse_args()
+    asyncio.run(main(args))
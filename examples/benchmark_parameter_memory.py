@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import os
+import tracemalloc
+
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from centrometal_web_boiler.WebBoilerDeviceCollection import WebBoilerDeviceCollection
+
+
+def create_installations(count):
+    installations = []
+    for i in range(0, count):
+        installations.append({
+            "value": 1000 + i,
+            "label": f"SN{i:06d}",
+            "place": "Place",
+            "address": "Address",
+            "type": "peltec",
+            "product": "PelTec",
+        })
+    return installations
+
+
+async def fill(collection, parameter_names):
+    for device in collection.values():
+        for name in parameter_names:
+            await device.update_parameter(name, "0", "2023-01-01 12:00:00")
+
+
+def measure(device_count, parameter_count, compact_parameters):
+    installations = create_installations(device_count)
+    parameter_names = [f"PRD {i}" for i in range(0, parameter_count)]
+    tracemalloc.start()
+    collection = WebBoilerDeviceCollection("benchmark", compact_parameters=compact_parameters)
+    collection.parse_installations(installations)
+    before, _ = tracemalloc.get_traced_memory()
+    asyncio.run(fill(collection, parameter_names))
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return after - before, peak
+
+
+def main(device_count, parameter_count):
+    parameter_total = device_count * parameter_count
+    print(f"{device_count} devices x {parameter_count} parameters")
+    print(f"{'layout':>8} {'total [MB]':>12} {'peak [MB]':>12} {'per param [B]':>14}")
+    for compact_parameters in [False, True]:
+        size, peak = measure(device_count, parameter_count, compact_parameters)
+        layout = "compact" if compact_parameters else "dict"
+        print(f"{layout:>8} {size / 1e6:>12.2f} {peak / 1e6:>12.2f} {size / parameter_total:>14.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='WebBoiler parameter memory benchmark.')
+    parser.add_argument('--devices', type=int, default=200, help='Number of devices')
+    parser.add_argument('--parameters', type=int, default=300, help='Parameters per device')
+    args = parser.parse_args()
+    main(args.devices, args.parameters)
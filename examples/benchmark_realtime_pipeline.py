@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import tracemalloc
+
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from centrometal_web_boiler.WebBoilerDeviceCollection import WebBoilerDeviceCollection
+from centrometal_web_boiler.WebBoilerInterestSet import WebBoilerInterestSet
+from centrometal_web_boiler.WebBoilerMetrics import WebBoilerMetrics
+from centrometal_web_boiler.WebBoilerWsClient import WebBoilerWsClient
+from centrometal_web_boiler.StompFrameParser import StompFrameParser, STOMP_DEFAULT_HEADERS
+from centrometal_web_boiler.const import WEB_BOILER_STOMP_DEVICE_TOPIC
+
+
+def create_installations(count):
+    installations = []
+    for i in range(0, count):
+        installations.append({
+            "value": 1000 + i,
+            "label": f"SN{i:06d}",
+            "place": "Place",
+            "address": "Address",
+            "type": "peltec",
+            "product": "PelTec",
+        })
+    return installations
+
+
+def create_raw_frame(serial, index, body):
+    destination = WEB_BOILER_STOMP_DEVICE_TOPIC + "peltec." + serial
+    return (
+        "MESSAGE\n"
+        "subscription:sub-1\n"
+        f"destination:{destination}\n"
+        f"message-id:T_sub-1@@session-benchmark@@{index}\n"
+        "redelivered:false\n"
+        "content-type:application/json\n"
+        f"content-length:{len(body.encode())}\n"
+        "\n"
+        f"{body}\x00"
+    )
+
+
+class FrameGenerator:
+    # Stands in for websocket connection: yields prepared frames and swallows sends
+    def __init__(self, frames, trace_memory, rate):
+        self.frames = frames
+        self.trace_memory = trace_memory
+        self.rate = rate
+        self.index = 0
+        self.received_at = []
+        self.next_time = None
+        self.dispatcher = None
+        self.sent = 0
+        self.memory_before = 0
+        self.frame_memory = []
+        self.close_code = 1000
+        self.close_reason = ""
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.trace_memory:
+            # wait until previous frame is fully processed so allocations are attributed to it
+            await self.dispatcher.join()
+            if self.index > 0:
+                current, peak = tracemalloc.get_traced_memory()
+                self.frame_memory.append(peak - self.memory_before)
+            tracemalloc.reset_peak()
+            self.memory_before = tracemalloc.get_traced_memory()[0]
+        if self.index >= len(self.frames):
+            raise StopAsyncIteration
+        if self.rate is not None:
+            loop = asyncio.get_running_loop()
+            if self.next_time is None:
+                self.next_time = loop.time()
+            self.next_time += 1 / self.rate
+            await asyncio.sleep(max(0, self.next_time - loop.time()))
+        frame = self.frames[self.index]
+        self.index += 1
+        self.received_at.append(time.perf_counter_ns())
+        return frame
+
+    async def send(self, content):
+        self.sent += 1
+
+    async def close(self, code = 1000, reason = ""):
+        pass
+
+
+class Histogram:
+    def __init__(self, name):
+        self.name = name
+        self.values = []
+
+    def add(self, value):
+        self.values.append(value)
+
+    def percentile(self, p):
+        if len(self.values) == 0:
+            return 0
+        values = sorted(self.values)
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+    def report(self):
+        print(f"    {self.name:<22} p50 {self.percentile(50) / 1000:>8.1f} us"
+              f"  p90 {self.percentile(90) / 1000:>8.1f} us"
+              f"  p99 {self.percentile(99) / 1000:>8.1f} us"
+              f"  max {max(self.values, default=0) / 1000:>8.1f} us")
+
+    def report_buckets(self):
+        buckets = dict()
+        for value in self.values:
+            bucket = max(0, value // 1000).bit_length()
+            buckets[bucket] = buckets.get(bucket, 0) + 1
+        for bucket in sorted(buckets.keys()):
+            upper = 1 << bucket
+            bar = "#" * max(1, int(50 * buckets[bucket] / len(self.values)))
+            print(f"      < {upper:>6} us {buckets[bucket]:>8} {bar}")
+
+
+async def run(device_count, frame_size, frame_count, trace_memory, show_buckets, raw_messages, rate, interest, metrics):
+    parameter_names = [f"PRD {i}" for i in range(0, max(frame_size, 1))]
+    collection = WebBoilerDeviceCollection("benchmark")
+    collection.parse_installations(create_installations(device_count))
+    for device in collection.values():
+        for name in parameter_names:
+            device.create_parameter(name, "0")
+    if interest is not None:
+        # consumer watches only first parameters of every frame
+        collection.set_interest(WebBoilerInterestSet(parameter_names[:interest]))
+    serials = list(collection.keys())
+    frames = []
+    for i in range(0, frame_count):
+        body = json.dumps({name: str(random.randint(0, 100)) for name in parameter_names[:frame_size]})
+        frames.append(create_raw_frame(serials[i % len(serials)], i, body))
+
+    generator = FrameGenerator(frames, trace_memory, rate)
+    unpack_latency = Histogram("receive -> unpacked")
+    parse_latency = Histogram("parse + callbacks")
+    callback_latency = Histogram("receive -> callback")
+    callbacks = [0]
+    received_at = [0]
+
+    async def on_parameter_updated(device, parameter, create = False):
+        callbacks[0] += 1
+        callback_latency.add(time.perf_counter_ns() - received_at[0])
+
+    async def data_callback(ws, stomp_frame):
+        start = time.perf_counter_ns()
+        # frames can wait in dispatch queue, match receive time by index in message-id
+        index = int(stomp_frame["headers"]["message-id"].rsplit("@@", 1)[1])
+        received_at[0] = generator.received_at[index]
+        unpack_latency.add(start - received_at[0])
+        await collection.parse_real_time_frame(stomp_frame)
+        parse_latency.add(time.perf_counter_ns() - start)
+
+    async def unused_callback(*args):
+        pass
+
+    collection.set_on_update_callback(on_parameter_updated)
+    ws_client = WebBoilerWsClient(
+        unused_callback, unused_callback, unused_callback, data_callback, raw_messages=raw_messages
+    )
+    if metrics:
+        metrics = WebBoilerMetrics()
+        ws_client.set_metrics(metrics)
+        collection.metrics = metrics
+    ws_client.parser = StompFrameParser(STOMP_DEFAULT_HEADERS + ("message-id",))
+    ws_client.client.connection = generator
+    generator.dispatcher = ws_client.dispatcher
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    # _ClientSocket__message_consumer is hack to call private method __message_consumer in ClientSocket
+    await ws_client.client._ClientSocket__message_consumer()
+    elapsed = time.perf_counter() - start
+    if trace_memory:
+        tracemalloc.stop()
+
+    print(f"  devices {device_count:>5}  parameters/frame {frame_size:>4}  frames {frame_count}"
+          + ("" if interest is None else f"  interest {interest}") + ("  metrics" if metrics else ""))
+    if not trace_memory:
+        print(f"    {frame_count / elapsed:>12.0f} frames/s {callbacks[0] / elapsed:>12.0f} callbacks/s"
+              f" {generator.sent / elapsed:>12.0f} sends/s")
+        for histogram in [unpack_latency, parse_latency, callback_latency]:
+            histogram.report()
+            if show_buckets:
+                histogram.report_buckets()
+        stats = ws_client.get_dispatch_stats()
+        print(f"    dispatch queue max depth {stats['max_depth']} dropped {stats['dropped']}"
+              f" coalesced {stats['coalesced']} errors {stats['errors']}")
+    else:
+        frame_memory = sorted(generator.frame_memory)
+        print(f"    allocated per frame: avg {sum(frame_memory) / len(frame_memory):>10.0f} B"
+              f"  p99 {frame_memory[int(len(frame_memory) * 0.99)]:>10} B")
+
+
+async def main(args):
+    for device_count in args.devices:
+        for frame_size in args.frame_sizes:
+            await run(device_count, frame_size, args.frames, False, args.buckets, not args.message_objects, args.rate, args.interest, args.metrics)
+            if args.memory:
+                await run(device_count, frame_size, min(args.frames, 1000), True, False, not args.message_objects, None, args.interest, args.metrics)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='WebBoiler real-time pipeline benchmark.')
+    parser.add_argument('--frames', type=int, default=10000, help='Frames per run')
+    parser.add_argument('--devices', type=int, nargs='+', default=[1, 10, 100], help='Device counts')
+    parser.add_argument('--frame-sizes', type=int, nargs='+', default=[1, 10, 100], help='Parameters per frame')
+    parser.add_argument('--rate', type=float, default=None, help='Frames per second offered, default as fast as possible')
+    parser.add_argument('--memory', action='store_true', help='Also measure allocations per frame with tracemalloc')
+    parser.add_argument('--message-objects', action='store_true', help='Wrap frames into Message objects (non raw mode)')
+    parser.add_argument('--interest', type=int, default=None, help='Register interest set of this many parameters')
+    parser.add_argument('--metrics', action='store_true', help='Observe metrics while processing frames')
+    parser.add_argument('--buckets', action='store_true', help='Print latency histogram buckets')
+    args = parser.parse_args()
+    asyncio.run(main(args))
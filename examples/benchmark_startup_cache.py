@@ -0,0 +1,55 @@
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import centrometal_web_boiler
+
+
+async def measure(username, password, cache):
+    client = centrometal_web_boiler.WebBoilerClient(configuration_cache=cache)
+    start = time.perf_counter()
+    if not await client.login(username, password):
+        raise Exception("Failed to login")
+    login_time = time.perf_counter() - start
+    if not await client.get_configuration():
+        raise Exception("Failed to get configuration")
+    configuration_time = time.perf_counter() - start - login_time
+    if client.status_refresh_task is not None:
+        await client.status_refresh_task
+    await client.http_client.close_session()
+    return login_time, configuration_time
+
+
+async def main(username, password, cache_path, runs):
+    cache = centrometal_web_boiler.WebBoilerConfigurationCache(cache_path)
+    cache.invalidate(username)
+    print(f"{'mode':>6} {'login [s]':>10} {'configuration [s]':>18}")
+    for i in range(0, runs):
+        login_time, configuration_time = await measure(username, password, None)
+        print(f"{'none':>6} {login_time:>10.3f} {configuration_time:>18.3f}")
+    # first run fills the cache, following runs start warm
+    login_time, configuration_time = await measure(username, password, cache)
+    print(f"{'cold':>6} {login_time:>10.3f} {configuration_time:>18.3f}")
+    for i in range(0, runs):
+        login_time, configuration_time = await measure(username, password, cache)
+        print(f"{'warm':>6} {login_time:>10.3f} {configuration_time:>18.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='WebBoiler startup with and without configuration cache.')
+    parser.add_argument('--username', help='Username')
+    parser.add_argument('--password', help='Password')
+    parser.add_argument('--cache', default=os.path.join(tempfile.gettempdir(), 'web-boiler-cache'), help='Cache directory')
+    parser.add_argument('--runs', type=int, default=3, help='Number of runs')
+    args = parser.parse_args()
+    if args.username == None or args.password == None:
+        parser.print_help()
+    else:
+        logging.basicConfig(level=logging.WARNING)
+        asyncio.run(main(args.username, args.password, args.cache, args.runs))
@@ -0,0 +1,49 @@
+import argparse
+import json
+import os
+import random
+import timeit
+
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import stomper
+from centrometal_web_boiler.StompFrameParser import StompFrameParser
+from centrometal_web_boiler.const import WEB_BOILER_STOMP_DEVICE_TOPIC
+
+
+def create_frame(parameter_count):
+    body = json.dumps({f"PRD {i}": str(random.randint(0, 100)) for i in range(0, parameter_count)})
+    return (
+        "MESSAGE\n"
+        "subscription:sub-1\n"
+        f"destination:{WEB_BOILER_STOMP_DEVICE_TOPIC}peltec.PT12345678\n"
+        "message-id:T_sub-1@@session-Yx5vT1qjWmcJxHq2eI9e1g@@1234\n"
+        "redelivered:false\n"
+        "content-type:application/json\n"
+        f"content-length:{len(body.encode())}\n"
+        "\n"
+        f"{body}\x00"
+    )
+
+
+def main(number):
+    print(f"{'parameters':>10} {'size [B]':>9} {'stomper [us]':>13} {'parser [us]':>12} {'bytes [us]':>11} {'speedup':>8}")
+    for parameter_count in [1, 5, 20, 100, 500]:
+        frame = create_frame(parameter_count)
+        frame_bytes = frame.encode()
+        parser = StompFrameParser()
+        assert json.loads(parser.feed(frame)[0]["body"]) == json.loads(stomper.unpack_frame(frame)["body"])
+        # best of several repeats, single runs are noisy
+        stomper_time = min(timeit.repeat(lambda: stomper.unpack_frame(frame), number=number, repeat=5)) / number
+        parser_time = min(timeit.repeat(lambda: parser.feed(frame), number=number, repeat=5)) / number
+        bytes_time = min(timeit.repeat(lambda: parser.feed(frame_bytes), number=number, repeat=5)) / number
+        print(f"{parameter_count:>10} {len(frame_bytes):>9} {stomper_time * 1e6:>13.2f} {parser_time * 1e6:>12.2f}"
+              f" {bytes_time * 1e6:>11.2f} {stomper_time / parser_time:>7.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='STOMP frame parser benchmark, stomper.unpack_frame vs StompFrameParser.')
+    parser.add_argument('--number', type=int, default=20000, help='Iterations per frame size')
+    args = parser.parse_args()
+    main(args.number)
@@ -0,0 +1,71 @@
+import argparse
+import asyncio
+import os
+import time
+
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from centrometal_web_boiler.WebBoilerClient import WebBoilerClient
+from centrometal_web_boiler.WebBoilerMockServer import WebBoilerMockServer
+
+
+async def read_sequential(client, start_index, size):
+    # how callers used get_table_data_all: every device after another, rows of one device together
+    for id in client.http_helper.get_all_devices_ids():
+        await asyncio.gather(*client.http_client.get_table_data_all(id, start_index, size))
+
+
+async def measure(name, coro, server):
+    requests = server.control_requests
+    start = time.perf_counter()
+    await coro
+    elapsed = time.perf_counter() - start
+    print(f"    {name:<28} {elapsed * 1000:>10.1f} ms {server.control_requests - requests:>8} requests")
+
+
+async def run(device_count, args):
+    server = WebBoilerMockServer(
+        devices=device_count, parameters=args.start_index + args.size + 1, rate=0,
+        http_port=args.http_port, ws_port=args.ws_port, http_latency=args.latency / 1000,
+    )
+    await server.start()
+    try:
+        client = WebBoilerClient(webroot=server.webroot, stomp_url=server.stomp_url)
+        await client.login("benchmark", "benchmark")
+        await client.get_configuration()
+        print(f"  devices {device_count:>5}  table size {args.size}  latency {args.latency} ms")
+        if device_count * args.size <= args.max_sequential_requests:
+            await measure("get_table_data_all", read_sequential(client, args.start_index, args.size), server)
+        for rows_per_request in [1, args.size]:
+            client.table_reader.rows_per_request = rows_per_request
+            for concurrency in args.concurrency:
+                client.table_reader.concurrency = concurrency
+                client.table_reader.semaphore = None
+                label = f"reader rows {rows_per_request} conc {concurrency}"
+                await measure(label, client.read_tables(args.start_index, args.size), server)
+        tables = await client.read_tables(args.start_index, args.size)
+        if not all(table.complete for table in tables.values()):
+            raise Exception("Incomplete table read")
+        await client.http_client.close_session()
+    finally:
+        await server.stop()
+
+
+async def main(args):
+    for device_count in args.devices:
+        await run(device_count, args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='WebBoiler table read benchmark against local mock server.')
+    parser.add_argument('--devices', type=int, nargs='+', default=[1, 10, 100], help='Device counts')
+    parser.add_argument('--size', type=int, default=24, help='Table rows')
+    parser.add_argument('--start-index', type=int, default=100, help='PRD index of table')
+    parser.add_argument('--latency', type=float, default=20, help='Mock server latency per request in ms')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[4, 16], help='Table reader concurrency')
+    parser.add_argument('--max-sequential-requests', type=int, default=300, help='Skip get_table_data_all run above this many requests')
+    parser.add_argument('--http-port', type=int, default=18080, help='Mock HTTP port')
+    parser.add_argument('--ws-port', type=int, default=18081, help='Mock STOMP port')
+    args = parser.parse_args()
+    asyncio.run(main(args))
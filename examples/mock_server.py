@@ -0,0 +1,47 @@
+import argparse
+import asyncio
+import logging
+import os
+
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from centrometal_web_boiler.WebBoilerMockServer import WebBoilerMockServer
+
+
+async def main(args):
+    server = WebBoilerMockServer(
+        devices=args.devices,
+        parameters=args.parameters,
+        rate=args.rate,
+        parameters_per_frame=args.parameters_per_frame,
+        host=args.host,
+        http_port=args.http_port,
+        ws_port=args.ws_port,
+    )
+    await server.start()
+    print(f"export WEB_BOILER_WEBROOT={server.webroot}")
+    print(f"export WEB_BOILER_STOMP_URL={server.stomp_url}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            logging.info(f"frames sent: {server.frames_sent} http requests: {server.http_requests}")
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local mock of web-boiler.com HTTP and STOMP service.')
+    parser.add_argument('--devices', type=int, default=10, help='Number of devices')
+    parser.add_argument('--parameters', type=int, default=100, help='Parameters per device')
+    parser.add_argument('--rate', type=float, default=10, help='STOMP frames published per second')
+    parser.add_argument('--parameters-per-frame', type=int, default=5, help='Parameters in every published frame')
+    parser.add_argument('--host', default='localhost', help='Listen host')
+    parser.add_argument('--http-port', type=int, default=8080, help='HTTP port')
+    parser.add_argument('--ws-port', type=int, default=15674, help='STOMP websocket port')
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s [%(levelname)s] %(message)s",
+        handlers=[ logging.StreamHandler()])
+    asyncio.run(main(args))
@@ -23,4 +23,7 @@ setup(
         "faust-cchardet>=2.1.8",
         "aiodns>=3.0.0",
     ],
+    extras_require={
+        "fast": ["orjson>=3.6"],
+    },
 )
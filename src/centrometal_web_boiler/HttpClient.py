@@ -4,90 +4,389 @@
 """
 
 import logging
+import asyncio
+import re
+import time
 import aiohttp
 import json
 import sys
 import traceback
-from lxml import html
+from lxml import etree, html
 
 from centrometal_web_boiler.const import WEB_BOILER_WEBROOT
+from centrometal_web_boiler.JsonStreamParser import JsonStreamParser, json_loads
 
+# Requests to these URLs only read data and may be repeated, controls and login check are never retried
+HTTP_IDEMPOTENT_URLS = (
+    "/notifications/data/get",
+    "/data/autocomplete/installation",
+    "/api/configuration",
+    "/api/widgets-grid",
+    "/wdata/data/",
+)
+HTTP_LOGIN_URLS = ("/login", "/login_check")
+# URLs that end with installation id or serial are counted together in statistics
+HTTP_PARAMETRIZED_URLS = (
+    "/wdata/data/parameter-list/",
+    "/api/inst/control/advanced/",
+)
+
+# Login pages are scanned for these markers instead of being parsed into DOM,
+# precompiled XPath is used only when scanner does not find them
+CSRF_TOKEN_INPUT = re.compile(rb'<input\b[^>]*\bname=["\']_csrf_token["\'][^>]*>', re.IGNORECASE)
+CSRF_TOKEN_VALUE = re.compile(rb'\bvalue=["\']([^"\']*)["\']', re.IGNORECASE)
+CSRF_TOKEN_XPATH = etree.XPath('//input[@name="_csrf_token"]/@value')
+LOGIN_SUCCESS_MARKER = re.compile(rb'<div\b[^>]*\bid=["\']id-loading-screen-blackout["\']', re.IGNORECASE)
+LOGIN_SUCCESS_XPATH = etree.XPath('//div[@id="id-loading-screen-blackout"]')
+
+
+class HttpClientError(Exception):
+    def __init__(self, message, url = None, status = None):
+        super().__init__(message)
+        self.url = url
+        self.status = status
+
+
+class HttpSessionExpiredError(HttpClientError):
+    pass
+
+
+class HttpCircuitOpenError(HttpClientError):
+    pass
+
+
+class HttpCircuitBreaker:
+    # Opens after failure_threshold consecutive failures, while open requests fail immediately.
+    # After reset_timeout one request is let through (half open), its result closes or reopens it.
+    # Trial which never reports its result (e.g. cancelled) is replaced after another reset_timeout.
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold = 5, reset_timeout = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = HttpCircuitBreaker.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self.opened = 0
+
+    def allow(self):
+        if self.state == HttpCircuitBreaker.CLOSED:
+            return True
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self.state = HttpCircuitBreaker.HALF_OPEN
+        self.opened_at = time.monotonic()
+        return True
+
+    def record_success(self):
+        self.state = HttpCircuitBreaker.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HttpCircuitBreaker.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != HttpCircuitBreaker.OPEN:
+                self.opened += 1
+            self.state = HttpCircuitBreaker.OPEN
+            self.opened_at = time.monotonic()
+
+    def record_aborted(self):
+        # request ended without result, half open trial goes back to open
+        if self.state == HttpCircuitBreaker.HALF_OPEN:
+            self.state = HttpCircuitBreaker.OPEN
+            self.opened_at = time.monotonic()
 
-class HttpClientBase:
 
-    headers = {"Origin": WEB_BOILER_WEBROOT, "Referer": WEB_BOILER_WEBROOT + "/"}
-    headers_json = {
-        "Origin": WEB_BOILER_WEBROOT,
-        "Referer": WEB_BOILER_WEBROOT + "/",
-        "Content-Type": "application/json;charset=UTF-8",
-    }
+class HttpEndpointStats:
+    __slots__ = ("requests", "errors", "retries", "timeouts", "latency_total", "latency_max")
 
-    def __init__(self, username, password):
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.latency_total = 0
+        self.latency_max = 0
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "timeouts": self.timeouts,
+            "error_rate": self.errors / self.requests if self.requests > 0 else 0,
+            "latency_avg": self.latency_total / (self.requests - self.errors) if self.requests > self.errors else 0,
+            "latency_max": self.latency_max,
+        }
+
+
+class HttpClientBase:
+
+    def __init__(self, username, password, connector = None, webroot = None):
         self.logger = logging.getLogger(__name__)
         self.username = username
         self.password = password
+        self.webroot = WEB_BOILER_WEBROOT if webroot is None else webroot
+        self.headers = {"Origin": self.webroot, "Referer": self.webroot + "/"}
+        self.headers_json = {
+            "Origin": self.webroot,
+            "Referer": self.webroot + "/",
+            "Content-Type": "application/json;charset=UTF-8",
+        }
         self.parameter_list = dict()
+        self.connector = connector
+        self.session_store = None
+        self.csrf_token = None
+        # cookie jar outlives sessions, so reinitialize_session keeps logged in session
+        self.cookie_jar = aiohttp.CookieJar()
+        # seconds, timeouts maps URL prefix to its own timeout
+        self.timeout = 30
+        self.timeouts = dict()
+        self.retries = 2
+        self.retry_delay = 0.5
+        self.relogin_enabled = True
+        self.relogin_lock = asyncio.Lock()
+        self.relogins = 0
+        self.circuit_breaker = HttpCircuitBreaker()
+        self.endpoint_stats = dict()
+        self.metrics = None
         self.http_session = None
-        self.http_session = aiohttp.ClientSession()
+        self.http_session = self.create_session()
+
+    def create_session(self):
+        if self.connector is None:
+            return aiohttp.ClientSession(cookie_jar=self.cookie_jar)
+        # connector is shared with other accounts, session must not close it
+        return aiohttp.ClientSession(connector=self.connector, connector_owner=False, cookie_jar=self.cookie_jar)
+
+    def clear_cookies(self):
+        self.cookie_jar.clear()
 
     async def reinitialize_session(self):
         await self.close_session()
-        self.http_session = aiohttp.ClientSession()
+        self.http_session = self.create_session()
 
     async def close_session(self):
         if self.http_session is not None:
             await self.http_session.close()
             self.http_session = None
 
-    async def _http_get(self, url, expected_code=200) -> html.HtmlElement:
-        full_url = WEB_BOILER_WEBROOT + url
-        self.logger.info(f"GET {full_url} ({self.username})")
-        response = await self.http_session.get(
-            full_url, headers=self.headers, ssl=False
-        )
-        if response.status != expected_code:
-            raise Exception(
-                f"HttpClientBase::__get {url} failed with http code: {response.status}"
-            )
-        responseText = await response.text()
-        return html.fromstring(responseText)
+    def set_timeout(self, timeout, url_prefix = None):
+        if url_prefix is None:
+            self.timeout = timeout
+        else:
+            self.timeouts[url_prefix] = timeout
 
-    async def _http_post(self, url, data=None, expected_code=200) -> html.HtmlElement:
-        full_url = WEB_BOILER_WEBROOT + url
-        self.logger.info(f"POST {full_url} -> {data} ({self.username})")
-        response = await self.http_session.post(
-            full_url, headers=self.headers, data=data, ssl=False
-        )
-        if response.status != expected_code:
-            raise Exception(
-                f"HttpClientBase::__post {url} failed with http code: {response.status}"
-            )
+    def get_timeout(self, url):
+        timeout = self.timeout
+        matched = ""
+        for prefix, prefix_timeout in self.timeouts.items():
+            if url.startswith(prefix) and len(prefix) > len(matched):
+                timeout, matched = prefix_timeout, prefix
+        return timeout
+
+    @staticmethod
+    def is_idempotent(url):
+        return url == "/login" or url.startswith(HTTP_IDEMPOTENT_URLS)
+
+    @staticmethod
+    def get_endpoint(url):
+        for prefix in HTTP_PARAMETRIZED_URLS:
+            if url.startswith(prefix):
+                return prefix + "{}"
+        if url.startswith("/api/inst/control/") and url != "/api/inst/control/multiple":
+            return "/api/inst/control/{}"
+        return url
+
+    def get_http_stats(self):
+        return {
+            "circuit": self.circuit_breaker.state,
+            "circuit_opened": self.circuit_breaker.opened,
+            "relogins": self.relogins,
+            "endpoints": {endpoint: stats.as_dict() for endpoint, stats in self.endpoint_stats.items()},
+        }
+
+    async def _relogin(self) -> bool:
+        return False
+
+    async def __relogin(self, generation):
+        async with self.relogin_lock:
+            # other request already logged in again while we waited
+            if generation != self.relogins:
+                return True
+            self.relogins += 1
+            self.logger.warning(f"HttpClientBase - session expired, logging in again ({self.username})")
+            return await self._relogin()
+
+    async def _request(self, method, url, headers, data, expected_code, read, relogin = True, stream = False):
+        full_url = self.webroot + url
+        endpoint = HttpClientBase.get_endpoint(url)
+        stats = self.endpoint_stats.get(endpoint)
+        if stats is None:
+            stats = self.endpoint_stats[endpoint] = HttpEndpointStats()
+        # streamed response is consumed while it is read, retry would pass members to reader again
+        retries = self.retries if HttpClientBase.is_idempotent(url) and not stream else 0
+        check_session = url not in HTTP_LOGIN_URLS
+        relogin = relogin and self.relogin_enabled
+        if stream:
+            # reader awaits consumer callbacks between reads, so only waiting for server is limited
+            timeout = aiohttp.ClientTimeout(total=None, connect=self.get_timeout(url), sock_read=self.get_timeout(url))
+        else:
+            timeout = aiohttp.ClientTimeout(total=self.get_timeout(url))
+        attempt = 0
+        while True:
+            if not self.circuit_breaker.allow():
+                raise HttpCircuitOpenError(
+                    f"HttpClientBase::_request {url} rejected, circuit is open", url
+                )
+            generation = self.relogins
+            stats.requests += 1
+            start = time.monotonic()
+            try:
+                async with self.http_session.request(
+                    method, full_url, headers=headers, data=data, ssl=False, timeout=timeout
+                ) as response:
+                    if check_session and (response.status in (401, 403) or response.url.path.endswith("/login")):
+                        raise HttpSessionExpiredError(
+                            f"HttpClientBase::_request {url} session expired", url, response.status
+                        )
+                    if response.status != expected_code:
+                        raise HttpClientError(
+                            f"HttpClientBase::_request {url} failed with http code: {response.status}",
+                            url, response.status,
+                        )
+                    result = await read(url, response)
+                latency = time.monotonic() - start
+                stats.latency_total += latency
+                stats.latency_max = max(stats.latency_max, latency)
+                if self.metrics is not None:
+                    self.metrics.http_request_duration.observe(latency, (self.username, endpoint))
+                self.circuit_breaker.record_success()
+                return result
+            except HttpSessionExpiredError:
+                stats.errors += 1
+                # server answered, session is not a failure of the service
+                self.circuit_breaker.record_success()
+                if not relogin or attempt > 0 or not await self.__relogin(generation):
+                    raise
+                stats.retries += 1
+            except (asyncio.TimeoutError, aiohttp.ClientError, HttpClientError) as e:
+                stats.errors += 1
+                if isinstance(e, asyncio.TimeoutError):
+                    stats.timeouts += 1
+                # client errors (4xx) are not failures of the service
+                status = getattr(e, "status", None)
+                if status is None or status >= 500:
+                    self.circuit_breaker.record_failure()
+                else:
+                    self.circuit_breaker.record_success()
+                if attempt >= retries or (status is not None and status < 500):
+                    if isinstance(e, HttpClientError):
+                        raise
+                    raise HttpClientError(
+                        f"HttpClientBase::_request {url} failed: {e!r}", url
+                    ) from e
+                stats.retries += 1
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+            except BaseException:
+                # cancelled or failed while reading, half open trial must not stay unresolved
+                self.circuit_breaker.record_aborted()
+                raise
+            attempt += 1
+
+    @staticmethod
+    async def __read_html(url, response) -> html.HtmlElement:
+        responseText = await response.text()
         try:
-            responseText = await response.text()
             return html.fromstring(responseText)
-        except:
-            raise Exception(
-                f"HttpClientBase::__post {url} failed to parse html content: {responseText}"
+        except Exception:
+            raise HttpClientError(
+                f"HttpClientBase::__post {url} failed to parse html content: {responseText}", url
             )
 
-    async def _http_post_json(self, url, data=None, expected_code=200) -> dict:
-        full_url = WEB_BOILER_WEBROOT + url
-        self.logger.info(f"POST-json {full_url} -> {data} ({self.username})")
-        response = await self.http_session.post(
-            full_url, headers=self.headers_json, data=data, ssl=False
-        )
-        if response.status != expected_code:
-            raise Exception(
-                f"HttpClientBase::_http_post_json {url} failed with http code: {response.status}"
-            )
+    @staticmethod
+    async def __read_json(url, response) -> dict:
+        # bytes are decoded directly, without intermediate str
+        body = await response.read()
         try:
-            responseText = await response.text()
-            return json.loads(responseText)
-        except:
-            raise Exception(
-                f"HttpClientBase::_http_post_json {url} failed to parse json content: {responseText}"
+            return json_loads(body)
+        except Exception:
+            raise HttpClientError(
+                f"HttpClientBase::_http_post_json {url} failed to parse json content: {body[:1000]}", url
             )
 
+    async def _http_get(self, url, expected_code=200) -> html.HtmlElement:
+        self.logger.info(f"GET {self.webroot + url} ({self.username})")
+        return await self._request(
+            "GET", url, self.headers, None, expected_code, HttpClientBase.__read_html
+        )
+
+    async def _http_post(self, url, data=None, expected_code=200) -> html.HtmlElement:
+        self.logger.info(f"POST {self.webroot + url} -> {data} ({self.username})")
+        return await self._request(
+            "POST", url, self.headers, data, expected_code, HttpClientBase.__read_html
+        )
+
+    async def _http_post_json(self, url, data=None, expected_code=200, relogin=True) -> dict:
+        self.logger.info(f"POST-json {self.webroot + url} -> {data} ({self.username})")
+        return await self._request(
+            "POST", url, self.headers_json, data, expected_code, HttpClientBase.__read_json, relogin
+        )
+
+    @staticmethod
+    def __scan_reader(pattern, chunk_size = 16384):
+        # returns (match, None) when pattern is found, otherwise (None, body) so caller can fall back
+        # to full parsing. Rest of response is still read so connection can be reused.
+        async def read(url, response):
+            buffer = b""
+            match = None
+            async for chunk in response.content.iter_chunked(chunk_size):
+                if match is not None or pattern is None:
+                    continue
+                # tag can span chunks, search again from last tag start of previous data
+                start = max(0, buffer.rfind(b"<"))
+                buffer += chunk
+                match = pattern.search(buffer, start)
+            if match is not None:
+                return (match, None)
+            return (None, buffer)
+        return read
+
+    async def _http_get_scan(self, url, pattern, expected_code=200) -> tuple:
+        self.logger.info(f"GET-scan {self.webroot + url} ({self.username})")
+        return await self._request(
+            "GET", url, self.headers, None, expected_code, HttpClientBase.__scan_reader(pattern)
+        )
+
+    async def _http_post_scan(self, url, pattern, data=None, expected_code=200) -> tuple:
+        self.logger.info(f"POST-scan {self.webroot + url} ({self.username})")
+        return await self._request(
+            "POST", url, self.headers, data, expected_code, HttpClientBase.__scan_reader(pattern)
+        )
+
+    async def _http_post_json_stream(self, url, on_member, data=None, expected_code=200, chunk_size=65536) -> int:
+        # top level members of response are passed to on_member(key, value) as soon as they are
+        # received, whole response is never kept in memory, returns number of members
+        self.logger.info(f"POST-json-stream {self.webroot + url} -> {data} ({self.username})")
+
+        async def read(url, response):
+            parser = JsonStreamParser()
+            count = 0
+            try:
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    for key, value in parser.feed(chunk):
+                        await on_member(key, value)
+                        count += 1
+            except ValueError as e:
+                raise HttpClientError(f"HttpClientBase::_http_post_json_stream {url} failed to parse json content: {e}", url)
+            if not parser.finished:
+                raise HttpClientError(f"HttpClientBase::_http_post_json_stream {url} incomplete json content", url)
+            return count
+
+        return await self._request("POST", url, self.headers_json, data, expected_code, read, stream=True)
+
     async def _control_multiple(self, data):
         response = await self._http_post_json(
             "/api/inst/control/multiple", data=json.dumps(data)
@@ -116,15 +415,16 @@ class HttpClientBase:
 class HttpClient(HttpClientBase):
     async def __get_csrf_token(self) -> None:
         self.logger.info(f"HttpClient - Fetching getCsrfToken ({self.username})")
-        html_doc = await self._http_get("/login")
-        input_element = html_doc.xpath('//input[@name="_csrf_token"]')
-        if len(input_element) != 1:
-            raise Exception("HttpClient::getCsrfToken failed - cannot find csrf token")
-        values = input_element[0].xpath("@value")
+        match, body = await self._http_get_scan("/login", CSRF_TOKEN_INPUT)
+        if match is not None:
+            value = CSRF_TOKEN_VALUE.search(match.group(0))
+            values = [] if value is None else [value.group(1).decode()]
+        elif len(body) > 0:
+            values = CSRF_TOKEN_XPATH(html.fromstring(body))
+        else:
+            values = []
         if len(values) != 1:
-            raise Exception(
-                "HttpClient::getCsrfToken  failed - cannot find csrf token vaue"
-            )
+            raise Exception("HttpClient::getCsrfToken failed - cannot find csrf token")
         self.logger.info(f"HttpClient - csrf_token: {values[0]} ({self.username})")
         self.csrf_token = values[0]
 
@@ -135,16 +435,19 @@ class HttpClient(HttpClientBase):
         data["_username"] = self.username
         data["_password"] = self.password
         data["submit"] = "Log In"
-        html_doc = await self._http_post("/login_check", data=data)
-        loading_div_element = html_doc.xpath('//div[@id="id-loading-screen-blackout"]')
-        if len(loading_div_element) != 1:
+        # dashboard page is only checked for loading div, it is not parsed
+        match, body = await self._http_post_scan("/login_check", LOGIN_SUCCESS_MARKER, data=data)
+        if match is None and (len(body) == 0 or len(LOGIN_SUCCESS_XPATH(html.fromstring(body))) != 1):
             raise Exception("HttpClient::__loginCheck cannot find loading div element")
         self.logger.info(f"HttpClient - Login successfull ({self.username})")
 
     async def login(self) -> bool:
+        # full login starts without cookies of previous session, cookie jar outlives sessions
+        self.clear_cookies()
         try:
             await self.__get_csrf_token()
             await self.__login_check()
+            self.save_session()
             return True
         except Exception as e:
             self.logger.error(str(e) + f" ({self.username})")
@@ -155,8 +458,45 @@ class HttpClient(HttpClientBase):
             )
             return False
 
+    async def _relogin(self) -> bool:
+        return await self.login()
+
+    def save_session(self):
+        if self.session_store is None:
+            return
+        try:
+            self.session_store.save(self.username, self.webroot, self.cookie_jar, self.csrf_token)
+        except Exception as e:
+            self.logger.warning(f"HttpClient - failed to save session {e} ({self.username})")
+
+    async def is_session_valid(self) -> bool:
+        # one cheap request, expired session is reported instead of logging in again
+        try:
+            await self.get_configuration(relogin=False)
+            return True
+        except Exception as e:
+            self.logger.info(f"HttpClient - session is not valid {e} ({self.username})")
+            return False
+
+    async def resume_session(self) -> bool:
+        # restores cookies saved by previous login and checks them, full login is still needed on False
+        if self.session_store is None:
+            return False
+        session = self.session_store.load(self.username, self.webroot)
+        if session is None:
+            return False
+        self.session_store.restore_cookies(session, self.cookie_jar)
+        self.csrf_token = session["csrf_token"]
+        if await self.is_session_valid():
+            self.logger.info(f"HttpClient - resumed saved session ({self.username})")
+            return True
+        self.clear_cookies()
+        self.session_store.invalidate(self.username)
+        return False
+
     async def get_notifications(self) -> None:
-        html_doc = await self._http_post("/notifications/data/get")
+        # response is not used, it is read without parsing
+        await self._http_post_scan("/notifications/data/get", None)
 
     async def get_installations(self):
         self.installations = await self._http_post_json(
@@ -169,9 +509,9 @@ class HttpClient(HttpClientBase):
             + f" ({self.username})"
         )
 
-    async def get_configuration(self) -> None:
+    async def get_configuration(self, relogin = True) -> None:
         self.configuration = await self._http_post_json(
-            "/api/configuration", data=json.dumps({})
+            "/api/configuration", data=json.dumps({}), relogin=relogin
         )
         self.logger.debug(
             "HttpClient::get_configuration configuration -> "
@@ -201,6 +541,13 @@ class HttpClient(HttpClientBase):
             + f" ({self.username})"
         )
 
+    async def stream_installation_status_all(self, ids: list, on_installation_status) -> int:
+        # on_installation_status(id, status) is called for every installation while response is received
+        data = {"installations": ids}
+        return await self._http_post_json_stream(
+            "/wdata/data/installation-status-all", on_installation_status, data=json.dumps(data)
+        )
+
     async def get_parameter_list(self, serial) -> None:
         self.parameter_list[serial] = await self._http_post_json(
             "/wdata/data/parameter-list/" + serial, data=json.dumps({})
@@ -219,6 +566,14 @@ class HttpClient(HttpClientBase):
         data = {"messages": {str(id): {"RSTAT": "ALL"}}}
         return await self._control_multiple(data)
 
+    async def refresh_devices(self, ids) -> None:
+        data = {"messages": {str(id): {"REFRESH": 0} for id in ids}}
+        return await self._control_multiple(data)
+
+    async def rstat_all_devices(self, ids) -> None:
+        data = {"messages": {str(id): {"RSTAT": "ALL"} for id in ids}}
+        return await self._control_multiple(data)
+
     async def get_table_data(self, id, tableStartIndex, tableSubIndex) -> None:
         params = {
             "PRD " + str(tableStartIndex): "VAL",
@@ -227,6 +582,14 @@ class HttpClient(HttpClientBase):
         data = {"parameters": params}
         return await self._control_advanced(id, data)
 
+    async def get_table_data_rows(self, id, tableStartIndex, tableSubIndexes) -> None:
+        # like get_table_data, but several rows are requested in one parameters payload
+        params = {"PRD " + str(tableStartIndex): "VAL"}
+        for tableSubIndex in tableSubIndexes:
+            params["PRD " + str(tableStartIndex + tableSubIndex)] = "ALV"
+        data = {"parameters": params}
+        return await self._control_advanced(id, data)
+
     def get_table_data_all(self, id, tableStartIndex, tableSize):
         tasks = []
         for i in range(1, tableSize + 1):
@@ -238,6 +601,11 @@ class HttpClient(HttpClientBase):
         data = {"cmd-name": "CMD", "cmd-value": cmd_value}
         return await self._control(id, data)
 
+    async def send_commands(self, commands):
+        # commands is {id: {name: value}}, several installations in one request
+        data = {"messages": {str(id): values for id, values in commands.items()}}
+        return await self._control_multiple(data)
+
     async def turn_device_circuit(self, id, circuit, on):
         cmd_name = "PWR " + str(circuit)
         cmd_value = 1 if on else 0
@@ -8,6 +8,9 @@ from centrometal_web_boiler.HttpClient import HttpClient
 class HttpHelper:
     def __init__(self, client : HttpClient):
         self.client = client
+        self.indexed_installations = None
+        self.installations_by_id = dict()
+        self.installations_by_serial = dict()
     
     def get_device_count(self):
         return len(self.client.installations)
@@ -17,17 +20,30 @@ class HttpHelper:
             return self.client.installations[index]
         raise Exception("HttpHelper:getDevice invalid index")
 
-    def get_device_by_id(self, id):
+    def __update_indexes(self):
+        # installations list is replaced on every get_installations, rebuild indexes only then
+        if self.indexed_installations is self.client.installations:
+            return
+        self.installations_by_id = dict()
+        self.installations_by_serial = dict()
         for device in self.client.installations:
-            if str(device["value"]) == str(id):
-                return device
-        raise Exception("HttpHelper:get_device_by_id invalid id")
+            self.installations_by_id[str(device["value"])] = device
+            self.installations_by_serial[device["label"]] = device
+        self.indexed_installations = self.client.installations
+
+    def get_device_by_id(self, id):
+        self.__update_indexes()
+        device = self.installations_by_id.get(str(id))
+        if device is None:
+            raise Exception("HttpHelper:get_device_by_id invalid id")
+        return device
 
     def get_device_by_serial(self, serial):
-        for device in self.client.installations:
-            if device["label"] == serial:
-                return device
-        raise Exception("HttpHelper:get_device_by_serial invalid serial")
+        self.__update_indexes()
+        device = self.installations_by_serial.get(serial)
+        if device is None:
+            raise Exception("HttpHelper:get_device_by_serial invalid serial")
+        return device
 
     def get_all_devices_ids(self):
         result = []
@@ -39,4 +55,4 @@ class HttpHelper:
         result = []
         for device in self.client.installations:
             result.append(device["label"])
-        return result
\ No newline at end of file
+        return result
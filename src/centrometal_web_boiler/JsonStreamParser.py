@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import re
+import json
+import codecs
+
+# orjson is optional (pip install py-centrometal-web-boiler[fast]), it decodes bytes directly
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    json_loads = json.loads
+    JSON_BACKEND = "json"
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class JsonStreamParser:
+    # Incremental decoder for a JSON document whose top level is an object (or array).
+    # Bytes are fed in chunks as they arrive, feed returns list of (key, value) for every
+    # top level member completed so far (index instead of key for arrays). Only unfinished
+    # member is buffered, members are decoded by json C scanner (raw_decode), so an incomplete
+    # member costs one failed attempt per chunk.
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.started = False
+        self.array = False
+        self.index = 0
+        self.finished = False
+
+    def feed(self, data):
+        members = []
+        buffer = self.buffer + self.text_decoder.decode(data)
+        length = len(buffer)
+        position = WHITESPACE.match(buffer, 0).end()
+        if not self.started:
+            if position >= length:
+                self.buffer = ""
+                return members
+            if buffer[position] not in "{[":
+                raise ValueError(f"JsonStreamParser expects object or array, got {buffer[position:position + 20]}")
+            self.array = buffer[position] == "["
+            self.started = True
+            position += 1
+        end = "]" if self.array else "}"
+        raw_decode = self.decoder.raw_decode
+        while not self.finished:
+            start = position
+            position = WHITESPACE.match(buffer, position).end()
+            if position < length and buffer[position] == ",":
+                position = WHITESPACE.match(buffer, position + 1).end()
+            if position >= length:
+                position = start
+                break
+            if buffer[position] == end:
+                self.finished = True
+                position += 1
+                break
+            try:
+                if self.array:
+                    key = self.index
+                else:
+                    key, position = raw_decode(buffer, position)
+                    position = WHITESPACE.match(buffer, position).end()
+                    if buffer[position] != ":":
+                        raise ValueError(f"JsonStreamParser expects ':' at {position}")
+                    position = WHITESPACE.match(buffer, position + 1).end()
+                value, position = raw_decode(buffer, position)
+                # value must be followed by separator, otherwise number could be cut by chunk end
+                if WHITESPACE.match(buffer, position).end() >= length:
+                    raise IndexError()
+            except (ValueError, IndexError):
+                position = start
+                break
+            if self.array:
+                self.index += 1
+            members.append((key, value))
+        self.buffer = buffer[position:]
+        return members
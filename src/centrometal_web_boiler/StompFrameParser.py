@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+STOMP_DEFAULT_HEADERS = ("subscription", "destination")
+STOMP_MAX_FRAME_SIZE = 4 * 1024 * 1024
+
+STOMP_ESCAPES = {"\\n": "\n", "\\r": "\r", "\\c": ":", "\\\\": "\\"}
+
+
+def unescape_header_value(value):
+    if "\\" not in value:
+        return value
+    result = []
+    pos = 0
+    while pos < len(value):
+        escape = value[pos:pos + 2]
+        if escape in STOMP_ESCAPES:
+            result.append(STOMP_ESCAPES[escape])
+            pos += 2
+        else:
+            result.append(value[pos])
+            pos += 1
+    return "".join(result)
+
+
+class StompFrameParser:
+    # Incremental STOMP 1.2 decoder. Returns frames in the same form as stomper.unpack_frame
+    # ({"cmd", "headers", "body"}). MESSAGE frames take a fast path that looks up only wanted
+    # headers and slices the body once, other (rare) frames get all headers. str input is split
+    # on NUL, bytes input also honours content-length and returns body as memoryview.
+    # Incomplete frames are buffered until the rest is fed.
+    def __init__(self, headers = STOMP_DEFAULT_HEADERS, max_frame_size = STOMP_MAX_FRAME_SIZE):
+        self.headers = None if headers is None else tuple(headers)
+        self.max_frame_size = max_frame_size
+        self.buffer = None
+        self.position = 0
+        if self.headers is None:
+            self.needles = None
+            self.needles_bytes = None
+        else:
+            self.needles = [(name, "\n" + name + ":") for name in self.headers]
+            self.needles_bytes = [(name, ("\n" + name + ":").encode()) for name in self.headers]
+
+    def reset(self):
+        self.buffer = None
+
+    def feed(self, data):
+        if isinstance(data, (bytearray, memoryview)):
+            data = bytes(data)
+        if self.buffer is not None:
+            if type(self.buffer) != type(data):
+                raise Exception("StompFrameParser::feed cannot mix str and bytes data")
+            data = self.buffer + data
+            self.buffer = None
+        binary = isinstance(data, bytes)
+        nl, crlf = (b"\n", b"\r\n") if binary else ("\n", "\r\n")
+        frames = []
+        length = len(data)
+        pos = 0
+        while pos < length:
+            # skip heart-beats (EOLs between frames)
+            if data.startswith(nl, pos):
+                pos += 1
+                continue
+            if data.startswith(crlf, pos):
+                pos += 2
+                continue
+            frame = self.__parse_frame_bytes(data, pos, length) if binary else self.__parse_frame(data, pos, length)
+            if frame is None:
+                if length - pos > self.max_frame_size:
+                    raise Exception(f"StompFrameParser::feed frame exceeds {self.max_frame_size} bytes")
+                self.buffer = data[pos:]
+                break
+            frames.append(frame)
+            pos = self.position
+        return frames
+
+    def __parse_frame(self, data, pos, length):
+        cmd_end = data.find("\n", pos)
+        if cmd_end < 0:
+            return None
+        if data.startswith("\r", cmd_end - 1):
+            return self.__parse_frame_generic(data, pos, length, cmd_end)
+        headers_end = data.find("\n\n", cmd_end - 1)
+        if headers_end < 0:
+            return None
+        end = data.find("\x00", headers_end + 2)
+        if end < 0:
+            return None
+        cmd = data[pos:cmd_end]
+        if cmd != "MESSAGE" or self.needles is None:
+            return self.__parse_frame_generic(data, pos, length, cmd_end)
+        headers = dict()
+        for name, needle in self.needles:
+            start = data.find(needle, cmd_end - 1, headers_end + 1)
+            if start >= 0:
+                start += len(needle)
+                value = data[start:data.find("\n", start)]
+                headers[name] = unescape_header_value(value) if "\\" in value else value
+        self.position = end + 1
+        return {"cmd": cmd, "headers": headers, "body": data[headers_end + 2:end]}
+
+    def __parse_frame_bytes(self, data, pos, length):
+        cmd_end = data.find(b"\n", pos)
+        if cmd_end < 0:
+            return None
+        if data.startswith(b"\r", cmd_end - 1):
+            return self.__parse_frame_generic(data, pos, length, cmd_end)
+        headers_end = data.find(b"\n\n", cmd_end - 1)
+        if headers_end < 0:
+            return None
+        if data[pos:cmd_end] != b"MESSAGE" or self.needles_bytes is None:
+            return self.__parse_frame_generic(data, pos, length, cmd_end)
+        headers = dict()
+        for name, needle in self.needles_bytes:
+            start = data.find(needle, cmd_end - 1, headers_end + 1)
+            if start >= 0:
+                start += len(needle)
+                value = data[start:data.find(b"\n", start)].decode("utf-8")
+                headers[name] = unescape_header_value(value) if "\\" in value else value
+        end = self.__find_body_end(data, length, cmd_end, headers_end, headers_end + 2)
+        if end < 0:
+            return None
+        self.position = end + 1
+        return {"cmd": "MESSAGE", "headers": headers, "body": memoryview(data)[headers_end + 2:end]}
+
+    def __find_body_end(self, data, length, cmd_end, headers_end, body_start):
+        needle = b"\ncontent-length:"
+        start = data.find(needle, cmd_end - 1, headers_end + 1)
+        if start < 0:
+            return data.find(b"\x00", body_start)
+        start += len(needle)
+        end = body_start + int(data[start:data.find(b"\n", start)])
+        return end if end < length else -1
+
+    def __parse_frame_generic(self, data, pos, length, cmd_end):
+        # slow path for control frames and CRLF line endings, all headers are returned
+        binary = isinstance(data, bytes)
+        nl, cr, colon = (b"\n", b"\r", b":") if binary else ("\n", "\r", ":")
+        headers_end = data.find(nl + nl, cmd_end - 1)
+        headers_end_crlf = data.find(nl + cr + nl, cmd_end - 1)
+        if headers_end_crlf >= 0 and (headers_end < 0 or headers_end_crlf < headers_end):
+            headers_end = headers_end_crlf
+            body_start = headers_end + 3
+        elif headers_end >= 0:
+            body_start = headers_end + 2
+        else:
+            return None
+        headers = dict()
+        for line in data[cmd_end + 1:headers_end].split(nl):
+            name, separator, value = line.rstrip(cr).partition(colon)
+            if binary:
+                name = name.decode("utf-8")
+                value = value.decode("utf-8")
+            if separator and name not in headers:
+                headers[name] = unescape_header_value(value)
+        if binary:
+            end = self.__find_body_end(data, length, cmd_end, headers_end, body_start)
+        else:
+            end = data.find("\x00", body_start)
+        if end < 0:
+            return None
+        cmd = data[pos:cmd_end].rstrip(cr)
+        self.position = end + 1
+        if binary:
+            return {"cmd": cmd.decode("utf-8"), "headers": headers, "body": memoryview(data)[body_start:end]}
+        return {"cmd": cmd, "headers": headers, "body": data[body_start:end]}
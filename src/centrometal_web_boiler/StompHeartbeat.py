@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import logging
+import asyncio
+import time
+
+
+class StompHeartbeat:
+    # Sends STOMP heart-beats only when nothing else was sent for send_ratio of negotiated interval,
+    # so beats reach the server before the interval ends and its grace period is never needed,
+    # and reports timeout when server is silent for longer than its interval times tolerance.
+    # Time the reader is paused by full dispatch queue does not count as server silence.
+    # Websocket ping round trip is measured with every outgoing heart-beat.
+    def __init__(self, client, on_timeout, send_interval = 90000, receive_interval = 60000, tolerance = 1.5, username = "", send_ratio = 0.7):
+        self.logger = logging.getLogger(__name__)
+        self.client = client
+        self.on_timeout = on_timeout
+        self.send_interval = send_interval
+        self.receive_interval = receive_interval
+        self.tolerance = tolerance
+        self.send_ratio = send_ratio
+        self.username = username
+        self.outgoing = 0
+        self.incoming = 0
+        self.task = None
+        self.beats_sent = 0
+        self.beats_received = 0
+        self.missed_beats = 0
+        self.timeouts = 0
+        self.rtt = None
+        self.rtt_min = None
+        self.rtt_max = None
+        self.rtt_total = 0
+        self.rtt_count = 0
+        self.rtt_failures = 0
+
+    @property
+    def client_heart_beat(self):
+        # value for heart-beat header of CONNECT frame
+        return (self.send_interval, self.receive_interval)
+
+    @staticmethod
+    def negotiate(send_interval, receive_interval, heart_beat_header):
+        # returns (outgoing, incoming) intervals in milliseconds, 0 means disabled
+        try:
+            server_send, server_receive = [int(value) for value in heart_beat_header.split(",")]
+        except (AttributeError, ValueError):
+            return (0, 0)
+        outgoing = 0 if send_interval == 0 or server_receive == 0 else max(send_interval, server_receive)
+        incoming = 0 if receive_interval == 0 or server_send == 0 else max(receive_interval, server_send)
+        return (outgoing, incoming)
+
+    def start(self, heart_beat_header):
+        self.stop()
+        self.outgoing, self.incoming = StompHeartbeat.negotiate(
+            self.send_interval, self.receive_interval, heart_beat_header
+        )
+        self.logger.info(f"StompHeartbeat - outgoing {self.outgoing}ms incoming {self.incoming}ms ({self.username})")
+        if self.outgoing == 0 and self.incoming == 0:
+            return
+        now = time.monotonic()
+        if self.client.last_received == 0:
+            self.client.last_received = now
+        if self.client.last_sent == 0:
+            self.client.last_sent = now
+        self.task = asyncio.get_running_loop().create_task(self.__run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def on_heart_beat_received(self):
+        self.beats_received += 1
+
+    def stats(self):
+        return {
+            "outgoing_interval": self.outgoing,
+            "incoming_interval": self.incoming,
+            "beats_sent": self.beats_sent,
+            "beats_received": self.beats_received,
+            "missed_beats": self.missed_beats,
+            "timeouts": self.timeouts,
+            "rtt": self.rtt,
+            "rtt_min": self.rtt_min,
+            "rtt_max": self.rtt_max,
+            "rtt_avg": self.rtt_total / self.rtt_count if self.rtt_count > 0 else None,
+            "rtt_failures": self.rtt_failures,
+        }
+
+    async def __measure_rtt(self, timeout):
+        try:
+            rtt = await asyncio.wait_for(self.client.ping(), timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.rtt_failures += 1
+            return
+        self.rtt = rtt
+        self.rtt_min = rtt if self.rtt_min is None else min(self.rtt_min, rtt)
+        self.rtt_max = rtt if self.rtt_max is None else max(self.rtt_max, rtt)
+        self.rtt_total += rtt
+        self.rtt_count += 1
+
+    async def __run(self):
+        outgoing = self.outgoing * self.send_ratio / 1000
+        incoming = self.incoming * self.tolerance / 1000
+        rtt_task = None
+        while True:
+            now = time.monotonic()
+            deadlines = []
+            if outgoing > 0:
+                send_at = self.client.last_sent + outgoing
+                if send_at <= now:
+                    # connection was idle for whole interval, send EOL heart-beat
+                    try:
+                        await self.client.send("\n")
+                    except Exception as e:
+                        self.logger.warning(f"StompHeartbeat - failed to send heart-beat {e} ({self.username})")
+                    self.beats_sent += 1
+                    if rtt_task is None or rtt_task.done():
+                        rtt_task = asyncio.get_running_loop().create_task(self.__measure_rtt(outgoing))
+                    send_at = now + outgoing
+                deadlines.append(send_at)
+            if incoming > 0:
+                receive_at = self.client.last_received + incoming
+                if receive_at <= now and getattr(self.client, "reading_paused", False):
+                    # socket is not read while dispatch queue is full, heart-beats may be waiting unread
+                    self.client.last_received = now
+                    receive_at = now + incoming
+                if receive_at <= now:
+                    self.missed_beats += int((now - self.client.last_received) * 1000 / self.incoming)
+                    self.timeouts += 1
+                    self.logger.warning(f"StompHeartbeat - no data from server for {now - self.client.last_received:.1f}s ({self.username})")
+                    self.task = None
+                    if rtt_task is not None:
+                        rtt_task.cancel()
+                    await self.on_timeout()
+                    return
+                deadlines.append(receive_at)
+            await asyncio.sleep(max(0.05, min(deadlines) - time.monotonic()))
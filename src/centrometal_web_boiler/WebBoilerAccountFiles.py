@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import os
+import json
+import logging
+
+
+class WebBoilerAccountFiles:
+    # One JSON file per account in path, named after sanitized username and suffix.
+    def __init__(self, path, suffix = ".json", mode = None):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.suffix = suffix
+        # permission bits of created files, None keeps default umask based ones
+        self.mode = mode
+
+    def get_filename(self, username):
+        name = "".join(c if c.isalnum() or c in "._-@" else "_" for c in username)
+        return os.path.join(self.path, f"{name}{self.suffix}")
+
+    def read(self, username):
+        filename = self.get_filename(username)
+        try:
+            with open(filename, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            self.logger.warning(f"{type(self).__name__} - cannot read {filename}: {e} ({username})")
+            return None
+
+    def write(self, username, data):
+        os.makedirs(self.path, exist_ok=True)
+        filename = self.get_filename(username)
+        # write to temporary file first so interrupted write never leaves broken file
+        temp_filename = filename + ".tmp"
+        if self.mode is None:
+            f = open(temp_filename, "w", encoding="utf-8")
+        else:
+            f = os.fdopen(os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, self.mode), "w", encoding="utf-8")
+        with f:
+            json.dump(data, f)
+        os.replace(temp_filename, filename)
+
+    def invalidate(self, username):
+        try:
+            os.remove(self.get_filename(username))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import time
+import asyncio
+import fnmatch
+import logging
+
+
+class WebBoilerChangeFilter:
+    # Decides whether a parameter update is worth notifying. Update is suppressed when value
+    # equals the last delivered one, when numeric value moved less than deadband from it, or
+    # when less than min_interval seconds passed since the last delivery. Suppressed updates
+    # are still stored, later update is compared with the last delivered value, so slow drift
+    # is reported once it exceeds deadband. Update held back only by min_interval is delivered
+    # by deliver_callback(serial, name) when the interval ends (trailing edge), so consumers
+    # always end up with the latest value. Rules for names or fnmatch patterns override
+    # defaults, the last matching rule wins.
+    def __init__(self, deadband = 0, min_interval = 0):
+        self.logger = logging.getLogger(__name__)
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.rules = []
+        self.cache = dict()
+        self.last = dict()
+        self.pending = dict()
+        self.deliver_callback = None
+        self.delivered = 0
+        self.suppressed_unchanged = 0
+        self.suppressed_deadband = 0
+        self.suppressed_interval = 0
+
+    @staticmethod
+    def to_number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def set_rule(self, names, deadband = None, min_interval = None):
+        if isinstance(names, str):
+            names = [names]
+        for name in names:
+            self.rules.append((name, deadband, min_interval))
+        self.cache = dict()
+
+    def get_rule(self, name):
+        rule = self.cache.get(name)
+        if rule is None:
+            deadband, min_interval = self.deadband, self.min_interval
+            for pattern, rule_deadband, rule_min_interval in self.rules:
+                if fnmatch.fnmatchcase(name, pattern):
+                    if rule_deadband is not None:
+                        deadband = rule_deadband
+                    if rule_min_interval is not None:
+                        min_interval = rule_min_interval
+            rule = self.cache[name] = (deadband, min_interval)
+        return rule
+
+    def should_notify(self, serial, name, value):
+        return self.__check((serial, name), value, True)
+
+    def __check(self, key, value, count):
+        last = self.last.get(key)
+        now = time.monotonic()
+        if last is None:
+            self.last[key] = [value, None, now]
+            self.delivered += 1
+            return True
+        if value == last[0]:
+            if count:
+                self.suppressed_unchanged += 1
+            return False
+        deadband, min_interval = self.get_rule(key[1])
+        number = None
+        if deadband > 0:
+            number = WebBoilerChangeFilter.to_number(value)
+            if last[1] is None:
+                last[1] = WebBoilerChangeFilter.to_number(last[0])
+            if number is not None and last[1] is not None and abs(number - last[1]) < deadband:
+                if count:
+                    self.suppressed_deadband += 1
+                return False
+        if min_interval > 0 and now - last[2] < min_interval:
+            if count:
+                self.suppressed_interval += 1
+            self.__schedule(key, last[2] + min_interval - now)
+            return False
+        last[0] = value
+        last[1] = number
+        last[2] = now
+        self.delivered += 1
+        handle = self.pending.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+        return True
+
+    def __schedule(self, key, delay):
+        if self.deliver_callback is None or key in self.pending:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.pending[key] = loop.call_later(delay, lambda: loop.create_task(self.__deliver_pending(key)))
+
+    async def __deliver_pending(self, key):
+        self.pending.pop(key, None)
+        try:
+            await self.deliver_callback(*key)
+        except Exception as e:
+            self.logger.error(f"WebBoilerChangeFilter - delayed delivery of {key[1]} failed {e} ({key[0]})")
+
+    def accept_pending(self, serial, name, value):
+        # current value at the end of min_interval, delivered unless it is back within deadband
+        return self.__check((serial, name), value, False)
+
+    def reset(self, serial = None):
+        # forget delivered values, next update of every (or one device) parameter is delivered
+        if serial is None:
+            self.last = dict()
+        else:
+            for key in [key for key in self.last.keys() if key[0] == serial]:
+                del self.last[key]
+        for key in [key for key in self.pending.keys() if serial is None or key[0] == serial]:
+            self.pending.pop(key).cancel()
+
+    def get_stats(self):
+        suppressed = self.suppressed_unchanged + self.suppressed_deadband + self.suppressed_interval
+        return {
+            "delivered": self.delivered,
+            "suppressed": suppressed,
+            "suppressed_unchanged": self.suppressed_unchanged,
+            "suppressed_deadband": self.suppressed_deadband,
+            "suppressed_interval": self.suppressed_interval,
+        }
@@ -10,11 +10,25 @@ from centrometal_web_boiler.HttpClient import HttpClient
 from centrometal_web_boiler.HttpHelper import HttpHelper
 from centrometal_web_boiler.WebBoilerWsClient import WebBoilerWsClient
 from centrometal_web_boiler.WebBoilerDeviceCollection import WebBoilerDeviceCollection
+from centrometal_web_boiler.WebBoilerRefreshEngine import WebBoilerRefreshEngine, TokenBucket
+from centrometal_web_boiler.WebBoilerCommandQueue import WebBoilerCommandQueue
+from centrometal_web_boiler.WebBoilerTableReader import WebBoilerTableReader
+from centrometal_web_boiler.WebBoilerConfigurationCache import SNAPSHOT_RESPONSES
 
 
 class WebBoilerClient:
-    def __init__(self):
+    def __init__(self, compact_parameters = False, connector = None, configuration_cache = None, webroot = None, stomp_url = None, session_store = None, history = None, metrics = None):
         self.logger = logging.getLogger(__name__)
+        self.compact_parameters = compact_parameters
+        self.connector = connector
+        self.configuration_cache = configuration_cache
+        self.session_store = session_store
+        self.history = history
+        self.metrics = metrics
+        self.interest = None
+        self.change_filter = None
+        self.webroot = webroot
+        self.status_refresh_task = None
         self.websocket_connected = False
         self.connectivity_callback = None
         self.ws_client = WebBoilerWsClient(
@@ -22,19 +36,45 @@ class WebBoilerClient:
             self.ws_disconnected_callback,
             self.ws_error_callback,
             self.ws_data_callback,
+            stomp_url,
         )
+        if metrics is not None:
+            self.ws_client.set_metrics(metrics)
+            metrics.add_client(self)
 
     async def login(self, username, password):
         self.logger.info("WebBoilerClient - Logging in... (" + username + ")")
         self.username = username
         self.password = password
-        self.http_client = HttpClient(self.username, self.password)
+        self.http_client = HttpClient(self.username, self.password, self.connector, self.webroot)
+        self.http_client.session_store = self.session_store
+        self.http_client.metrics = self.metrics
         self.http_helper = HttpHelper(self.http_client)
-        self.data = WebBoilerDeviceCollection(username)
+        self.data = WebBoilerDeviceCollection(username, compact_parameters=self.compact_parameters)
+        self.data.set_history(self.history)
+        self.data.set_interest(self.interest)
+        self.data.set_change_filter(self.change_filter)
+        self.data.metrics = self.metrics
+        self.refresh_engine = WebBoilerRefreshEngine(self.http_client)
+        self.command_queue = WebBoilerCommandQueue(self.http_client)
+        self.table_reader = WebBoilerTableReader(self.http_client)
+        if await self.http_client.resume_session():
+            return True
         return await self.http_client.login()
 
     async def get_configuration(self):
-        await self.http_client.get_installations()
+        installations_fetched = False
+        if self.configuration_cache is not None:
+            snapshot = self.configuration_cache.load(self.username)
+            if snapshot is not None:
+                if self.configuration_cache.validate:
+                    await self.http_client.get_installations()
+                    installations_fetched = True
+                if not installations_fetched or self.configuration_cache.is_valid(snapshot, self.http_client.installations):
+                    return await self.__restore_configuration(snapshot)
+                self.logger.info(f"WebBoilerClient - cached configuration is outdated ({self.username})")
+        if not installations_fetched:
+            await self.http_client.get_installations()
         if self.http_helper.get_device_count() == 0:
             self.logger.warning(f"WebBoilerClient - there is no installed device ({self.username})")
             return False
@@ -48,22 +88,52 @@ class WebBoilerClient:
                 self.http_client.widgetgrid_list["selected"]
             )
         )
+        # statuses are parsed while response is received
         tasks.append(
-            self.http_client.get_installation_status_all(
-                self.http_helper.get_all_devices_ids()
+            self.http_client.stream_installation_status_all(
+                self.http_helper.get_all_devices_ids(), self.data.parse_installation_status
             )
         )
         for serial in self.http_helper.get_all_devices_serials():
             tasks.append(self.http_client.get_parameter_list(serial))
         tasks.append(self.http_client.get_notifications())
         await asyncio.gather(*tasks)
-        await self.data.parse_installation_statuses(
-            self.http_client.installation_status_all
-        )
         self.data.parse_parameter_lists(self.http_client.parameter_list)
         self.data.parse_grid(self.http_client)
+        if self.configuration_cache is not None:
+            try:
+                responses = {name: getattr(self.http_client, name) for name in SNAPSHOT_RESPONSES}
+                self.configuration_cache.save(self.username, responses, self.data.create_installation_status())
+            except Exception as e:
+                self.logger.warning(f"WebBoilerClient - failed to save configuration cache {e} ({self.username})")
+        return True
+
+    async def __restore_configuration(self, snapshot):
+        self.logger.info(f"WebBoilerClient - using cached configuration ({self.username})")
+        # cached responses go through the same parsing as fetched ones
+        for name, response in snapshot["responses"].items():
+            setattr(self.http_client, name, response)
+        if self.http_helper.get_device_count() == 0:
+            self.logger.warning(f"WebBoilerClient - there is no installed device ({self.username})")
+            return False
+        self.data.parse_installations(self.http_client.installations)
+        await self.data.parse_installation_statuses(snapshot["installation_status"])
+        self.data.parse_parameter_lists(self.http_client.parameter_list)
+        self.data.parse_grid(self.http_client)
+        # only live values are refreshed, everything else comes from snapshot
+        self.status_refresh_task = asyncio.get_running_loop().create_task(self.refresh_installation_statuses())
         return True
 
+    async def refresh_installation_statuses(self) -> bool:
+        try:
+            await self.http_client.stream_installation_status_all(
+                self.http_helper.get_all_devices_ids(), self.data.parse_installation_status
+            )
+            return True
+        except Exception as e:
+            self.logger.error("WebBoilerClient::refresh_installation_statuses failed" + str(e) + f" ({self.username})")
+            return False
+
     async def close_websocket(self) -> bool:
         try:
             await self.ws_client.close()
@@ -72,20 +142,47 @@ class WebBoilerClient:
             self.logger.error("WebBoilerClient::close_websocket failed" + str(e) + f" ({self.username})")
             return False
 
-    async def start_websocket(self, on_parameter_updated_callback):
+    async def reconcile_installation_statuses(self) -> bool:
+        try:
+            changed = [0]
+
+            async def reconcile_installation_status(device_id, value):
+                changed[0] += await self.data.reconcile_installation_status(device_id, value)
+
+            await self.http_client.stream_installation_status_all(
+                self.http_helper.get_all_devices_ids(), reconcile_installation_status
+            )
+            changed = changed[0]
+            self.logger.info(f"WebBoilerClient - reconciled {changed} changed parameters ({self.username})")
+            return True
+        except Exception as e:
+            self.logger.error("WebBoilerClient::reconcile_installation_statuses failed" + str(e) + f" ({self.username})")
+            return False
+
+    async def start_websocket(self, on_parameter_updated_callback, on_batch_updated_callback = None, batch_window = 0, reconnect = False):
         self.logger.info(f"WebBoilerClient - Starting websocket... ({self.username})")
         self.on_parameter_updated_callback = on_parameter_updated_callback
+        self.on_batch_updated_callback = on_batch_updated_callback
+        self.data.set_batch_window(batch_window)
+        # with reconnect websocket is reestablished with backoff, subscriptions are replayed
+        # on every CONNECTED frame and values missed while disconnected are reconciled
+        self.ws_client.set_reconnect(reconnect)
         device = list(self.data.values())[0]
         await self.ws_client.start(self.username)
 
+    def set_refresh_limits(self, concurrency = None, rate = None, burst = None, pack_size = None):
+        self.refresh_engine.set_limits(concurrency, rate, burst, pack_size)
+
+    async def refresh_devices(self, delay = 2, on_device_refreshed = None) -> dict:
+        # {id: True or exception}, on_device_refreshed(id, success, error) reports progress
+        return await self.refresh_engine.refresh(
+            self.http_helper.get_all_devices_ids(), delay, on_device_refreshed
+        )
+
     async def refresh(self, delay = 2) -> bool:
         try:
-            for id in self.http_helper.get_all_devices_ids():
-                await self.http_client.refresh_device(id)
-                await asyncio.sleep(delay)
-                await self.http_client.rstat_all_device(id)
-                await asyncio.sleep(delay)
-            return True
+            results = await self.refresh_devices(delay)
+            return all(result is True for result in results.values())
         except Exception as e:
             self.logger.error("WebBoilerClient::refresh failed" + str(e) + f" ({self.username})")
             return False
@@ -100,13 +197,21 @@ class WebBoilerClient:
             device = self.data.get_device_by_serial(serial)
             await self.ws_client.subscribe_to_installation(ws, device)
         self.data.set_on_update_callback(self.on_parameter_updated_callback)
-        await self.data.notify_all_updated()
+        self.data.set_on_batch_update_callback(self.on_batch_updated_callback)
+        await self.notify_connectivity_changed()
+        if self.ws_client.reconnected:
+            self.status_refresh_task = asyncio.get_running_loop().create_task(self.reconcile_installation_statuses())
+
+    async def notify_connectivity_changed(self):
+        # consumers without connectivity callback learn about (dis)connection only through
+        # parameter callbacks, so they still get everything, others get only changed parameters
+        await self.data.notify_all_updated(full=self.connectivity_callback is None)
 
     async def ws_disconnected_callback(self, ws, close_status_code, close_msg):
         self.websocket_connected = False
         if self.connectivity_callback is not None:
             await self.connectivity_callback(self.websocket_connected)
-        await self.data.notify_all_updated()
+        await self.notify_connectivity_changed()
         self.logger.warning(
             f"WebBoilerClient - disconnected close_status_code:{close_status_code} close_msg:{close_msg} ({self.username})"
         )
@@ -123,12 +228,22 @@ class WebBoilerClient:
     async def relogin(self):
         await self.http_client.close_session()
         await self.http_client.reinitialize_session()
+        # with session store, cookie jar survives reinitialization and is reused while valid,
+        # otherwise login starts with empty cookie jar
+        if self.session_store is not None and await self.http_client.is_session_valid():
+            return True
         return await self.http_client.login()
 
+    def set_command_window(self, window, rate = 0, burst = None):
+        # turn and turn_circuit commands issued within window seconds are sent together,
+        # by default only commands issued in the same event loop iteration are merged
+        self.command_queue.window = window
+        self.command_queue.bucket = TokenBucket(rate, burst)
+
     async def turn(self, serial, on):
         device = self.data.get_device_by_serial(serial)
         try:
-            response = await self.http_client.turn_device_by_id(device["id"], on)
+            response = await self.command_queue.submit(device["id"], "CMD", on)
             return response["status"] == "success"
         except Exception as e:
             return False
@@ -136,12 +251,49 @@ class WebBoilerClient:
     async def turn_circuit(self, serial, circuit, on):
         device = self.data.get_device_by_serial(serial)
         try:
-            response = await self.http_client.turn_device_circuit(
-                device["id"], circuit, on
+            response = await self.command_queue.submit(
+                device["id"], "PWR " + str(circuit), 1 if on else 0
             )
             return response["status"] == "success"
         except Exception as e:
             return False
 
+    async def read_table(self, serial, start_index, size):
+        device = self.data.get_device_by_serial(serial)
+        return await self.table_reader.read_table(device["id"], start_index, size)
+
+    async def read_tables(self, start_index, size):
+        # same table of every device, {serial: WebBoilerTable}
+        serials = list(self.data.keys())
+        tables = await self.table_reader.read_tables(
+            [(self.data[serial]["id"], start_index, size) for serial in serials]
+        )
+        return dict(zip(serials, tables))
+
+    def set_interest(self, interest):
+        # WebBoilerInterestSet of parameters whose real time updates are stored and dispatched
+        self.interest = interest
+        if hasattr(self, "data"):
+            self.data.set_interest(interest)
+
+    def set_change_filter(self, change_filter):
+        # WebBoilerChangeFilter deciding which parameter updates reach callbacks
+        self.change_filter = change_filter
+        if hasattr(self, "data"):
+            self.data.set_change_filter(change_filter)
+
+    def start_recording(self, recorder):
+        # raw websocket messages are appended to WebBoilerFrameRecorder, together with
+        # device snapshot needed to replay them offline with WebBoilerFrameReplay
+        recorder.record_snapshot(self.username, self.data.create_snapshot())
+        self.ws_client.recorder = recorder
+
+    def stop_recording(self):
+        recorder = self.ws_client.recorder
+        self.ws_client.recorder = None
+        if recorder is not None:
+            recorder.close()
+        return recorder
+
     def set_connectivity_callback(self, connectivity_callback):
         self.connectivity_callback = connectivity_callback
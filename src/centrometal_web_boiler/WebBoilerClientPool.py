@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import logging
+import asyncio
+import ssl
+import aiohttp
+
+from centrometal_web_boiler.WebBoilerClient import WebBoilerClient
+
+
+class WebBoilerClientPool:
+    def __init__(self, limit = 100, limit_per_host = 10, ttl_dns_cache = 300, concurrency = 10, compact_parameters = False, configuration_cache = None, webroot = None, stomp_url = None, session_store = None, history = None, metrics = None):
+        self.logger = logging.getLogger(__name__)
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.ttl_dns_cache = ttl_dns_cache
+        self.concurrency = concurrency
+        self.compact_parameters = compact_parameters
+        self.configuration_cache = configuration_cache
+        self.webroot = webroot
+        self.stomp_url = stomp_url
+        self.session_store = session_store
+        # one history is shared by all accounts, series are keyed by device serial
+        self.history = history
+        self.metrics = metrics
+        self.connector = None
+        self.ssl_context = None
+        self.accounts = dict()
+        self.clients = dict()
+        self.on_parameter_updated_callback = None
+        self.on_batch_updated_callback = None
+        self.batch_window = 0
+        self.reconnect = False
+        self.connectivity_callback = None
+
+    def get_connector(self):
+        # connector is created lazily so it binds to the running event loop
+        if self.connector is None or self.connector.closed:
+            self.connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.ttl_dns_cache,
+            )
+        return self.connector
+
+    def get_ssl_context(self):
+        if self.ssl_context is None:
+            self.ssl_context = ssl.create_default_context()
+        return self.ssl_context
+
+    def add_account(self, username, password):
+        self.accounts[username] = password
+
+    def remove_account(self, username):
+        self.accounts.pop(username, None)
+
+    def get_client(self, username) -> WebBoilerClient:
+        return self.clients[username]
+
+    def get_all_devices(self):
+        result = []
+        for client in self.clients.values():
+            result.extend(client.data.values())
+        return result
+
+    def set_connectivity_callback(self, connectivity_callback):
+        # connectivity_callback(username, connected) is called for every account
+        self.connectivity_callback = connectivity_callback
+
+    def __create_connectivity_callback(self, username):
+        async def connectivity_callback(connected):
+            if self.connectivity_callback is not None:
+                await self.connectivity_callback(username, connected)
+        return connectivity_callback
+
+    async def __start_account(self, semaphore, username):
+        async with semaphore:
+            client = WebBoilerClient(
+                self.compact_parameters, self.get_connector(), self.configuration_cache, self.webroot, self.stomp_url,
+                self.session_store, self.history, self.metrics,
+            )
+            client.ws_client.ssl_context = self.get_ssl_context()
+            client.set_connectivity_callback(self.__create_connectivity_callback(username))
+            self.clients[username] = client
+            if not await client.login(username, self.accounts[username]):
+                self.logger.error(f"WebBoilerClientPool - failed to login ({username})")
+                return False
+            if not await client.get_configuration():
+                self.logger.error(f"WebBoilerClientPool - failed to get configuration ({username})")
+                return False
+        await client.start_websocket(
+            self.on_parameter_updated_callback, self.on_batch_updated_callback, self.batch_window, self.reconnect
+        )
+        return True
+
+    async def start(self, on_parameter_updated_callback, on_batch_updated_callback = None, batch_window = 0, reconnect = False):
+        # all accounts report to the same callbacks, device["serial"] and device.username identify the source
+        self.on_parameter_updated_callback = on_parameter_updated_callback
+        self.on_batch_updated_callback = on_batch_updated_callback
+        self.batch_window = batch_window
+        self.reconnect = reconnect
+        semaphore = asyncio.Semaphore(self.concurrency)
+        usernames = list(self.accounts.keys())
+        results = await asyncio.gather(
+            *[self.__start_account(semaphore, username) for username in usernames],
+            return_exceptions=True,
+        )
+        started = dict()
+        for username, result in zip(usernames, results):
+            if isinstance(result, Exception):
+                self.logger.error(f"WebBoilerClientPool - failed to start {result} ({username})")
+                result = False
+            started[username] = result
+        return started
+
+    async def relogin(self, username):
+        client = self.clients[username]
+        if not await client.relogin():
+            self.logger.error(f"WebBoilerClientPool - failed to relogin ({username})")
+            return False
+        await client.close_websocket()
+        await client.start_websocket(
+            self.on_parameter_updated_callback, self.on_batch_updated_callback, self.batch_window, self.reconnect
+        )
+        return True
+
+    async def relogin_all(self):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def relogin(username):
+            async with semaphore:
+                try:
+                    return await self.relogin(username)
+                except Exception as e:
+                    self.logger.error(f"WebBoilerClientPool - relogin failed {e} ({username})")
+                    return False
+
+        usernames = list(self.clients.keys())
+        results = await asyncio.gather(*[relogin(username) for username in usernames])
+        return dict(zip(usernames, results))
+
+    async def refresh(self, delay = 2):
+        results = await asyncio.gather(*[client.refresh(delay) for client in self.clients.values()])
+        return dict(zip(self.clients.keys(), results))
+
+    async def close(self):
+        for client in self.clients.values():
+            await client.close_websocket()
+            if hasattr(client, "http_client"):
+                await client.http_client.close_session()
+            if self.metrics is not None:
+                self.metrics.remove_client(client)
+        self.clients = dict()
+        if self.connector is not None:
+            await self.connector.close()
+            self.connector = None
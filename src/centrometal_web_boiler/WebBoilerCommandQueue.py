@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import logging
+import asyncio
+
+from centrometal_web_boiler.WebBoilerRefreshEngine import TokenBucket
+
+
+class WebBoilerCommandQueue:
+    # Collects control commands for window seconds and sends them as one /api/inst/control/multiple
+    # request with messages keyed by installation id. Later command with the same name for the same
+    # installation replaces earlier one (e.g. PWR 1 on then off sends only off). CMD (device on/off)
+    # is coalesced the same way but has its own endpoint, so it is sent per installation.
+    # Every caller gets the response of the request that carried (or superseded) its command.
+    def __init__(self, http_client, window = 0, rate = 0, burst = None, max_commands = 100):
+        self.logger = logging.getLogger(__name__)
+        self.http_client = http_client
+        self.window = window
+        self.max_commands = max_commands
+        self.bucket = TokenBucket(rate, burst)
+        self.pending = dict()
+        self.pending_count = 0
+        self.flush_task = None
+        self.submitted = 0
+        self.coalesced = 0
+        self.requests = 0
+        self.failures = 0
+
+    def get_stats(self):
+        return {
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "requests": self.requests,
+            "failures": self.failures,
+            "pending": self.pending_count,
+        }
+
+    async def submit(self, id, name, value):
+        future = asyncio.get_running_loop().create_future()
+        commands = self.pending.setdefault(str(id), dict())
+        self.submitted += 1
+        if name in commands:
+            commands[name][1].append(future)
+            commands[name] = (value, commands[name][1])
+            self.coalesced += 1
+        else:
+            commands[name] = (value, [future])
+            self.pending_count += 1
+        if self.pending_count >= self.max_commands:
+            await self.flush()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.get_running_loop().create_task(self.__flush_later())
+        return await future
+
+    async def __flush_later(self):
+        await asyncio.sleep(self.window)
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        if self.flush_task is not None and self.flush_task is not asyncio.current_task():
+            self.flush_task.cancel()
+            self.flush_task = None
+        pending = self.pending
+        self.pending = dict()
+        self.pending_count = 0
+        messages = dict()
+        device_commands = []
+        for id, commands in pending.items():
+            for name, (value, futures) in commands.items():
+                if name == "CMD":
+                    device_commands.append((id, value, futures))
+                else:
+                    messages.setdefault(id, dict())[name] = (value, futures)
+        tasks = [self.__send_device_command(id, value, futures) for id, value, futures in device_commands]
+        if len(messages) > 0:
+            tasks.append(self.__send_messages(messages))
+        await asyncio.gather(*tasks)
+
+    def __resolve(self, futures, response = None, error = None):
+        for future in futures:
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(response)
+            else:
+                future.set_exception(error)
+
+    async def __send_messages(self, messages):
+        futures = [future for commands in messages.values() for _, command_futures in commands.values() for future in command_futures]
+        commands = {id: {name: value for name, (value, _) in commands.items()} for id, commands in messages.items()}
+        try:
+            await self.bucket.acquire()
+            self.requests += 1
+            response = await self.http_client.send_commands(commands)
+        except Exception as e:
+            self.failures += 1
+            self.logger.error(f"WebBoilerCommandQueue - sending {commands} failed {e} ({self.http_client.username})")
+            self.__resolve(futures, error=e)
+            return
+        self.__resolve(futures, response)
+
+    async def __send_device_command(self, id, value, futures):
+        try:
+            await self.bucket.acquire()
+            self.requests += 1
+            response = await self.http_client.turn_device_by_id(id, value)
+        except Exception as e:
+            self.failures += 1
+            self.logger.error(f"WebBoilerCommandQueue - turning {id} failed {e} ({self.http_client.username})")
+            self.__resolve(futures, error=e)
+            return
+        self.__resolve(futures, response)
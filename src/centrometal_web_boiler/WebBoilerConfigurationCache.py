@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import time
+import logging
+from centrometal_web_boiler.WebBoilerAccountFiles import WebBoilerAccountFiles
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_RESPONSES = ("installations", "configuration", "widgetgrid_list", "widgetgrid", "parameter_list")
+
+
+class WebBoilerConfigurationCache(WebBoilerAccountFiles):
+    # Keeps raw HTTP responses of configuration requests and last installation statuses, so that
+    # warm start parses exactly what cold start would have fetched.
+    def __init__(self, path, ttl = 24 * 3600, validate = True):
+        super().__init__(path, ".json")
+        self.logger = logging.getLogger(__name__)
+        self.ttl = ttl
+        # validate compares cached installations with fresh installation list (one request)
+        self.validate = validate
+
+    def load(self, username):
+        snapshot = self.read(username)
+        if snapshot is None:
+            return None
+        if snapshot.get("version") != SNAPSHOT_VERSION or snapshot.get("username") != username:
+            return None
+        if self.ttl is not None and time.time() - snapshot.get("created", 0) > self.ttl:
+            self.logger.info(f"WebBoilerConfigurationCache - snapshot expired ({username})")
+            return None
+        return snapshot
+
+    def is_valid(self, snapshot, installations):
+        return snapshot["responses"]["installations"] == installations
+
+    def save(self, username, responses, installation_status):
+        # responses maps SNAPSHOT_RESPONSES names to HttpClient attributes of the same name
+        snapshot = {
+            "version": SNAPSHOT_VERSION,
+            "username": username,
+            "created": time.time(),
+            "responses": {name: responses[name] for name in SNAPSHOT_RESPONSES},
+            "installation_status": installation_status,
+        }
+        self.write(username, snapshot)
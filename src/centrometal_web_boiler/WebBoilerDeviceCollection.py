@@ -5,14 +5,48 @@
 
 import json
 import time
+import asyncio
 import datetime
 import logging
+import functools
+from collections.abc import MutableMapping
 
 from centrometal_web_boiler.const import WEB_BOILER_STOMP_DEVICE_TOPIC, WEB_BOILER_STOMP_NOTIFICATION_TOPIC
 
+# Monotonic sequence shared by all parameters, a parameter gets new version when created
+# and whenever its value changes
+parameter_version = 0
+
+def next_parameter_version():
+    global parameter_version
+    parameter_version += 1
+    return parameter_version
+
+def current_parameter_version():
+    return parameter_version
+
+# device dicts keyed by a field of their items, see parse_parameter_lists and parse_grid
+DEVICE_LIST_INDEX_KEYS = {
+    "temperatures": "dbindex",
+    "info": "installation_status",
+    "weather": "naslov",
+    "circuits": "naslov",
+    "widgets": "id",
+}
+
+@functools.lru_cache(maxsize=1024)
+def parse_timestamp(timestamp):
+    # status responses repeat the same few timestamps for all parameters
+    date_time_obj = datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+    return int(date_time_obj.replace(tzinfo=datetime.timezone.utc).timestamp())
+
+def format_timestamp(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
 class WebBoilerParameter(dict):
     def __init__(self):
         self.update_callbacks = dict()
+        self.version = next_parameter_version()
 
     def set_update_callback(self, update_callback, update_key = "default"):
         if update_callback == None:
@@ -21,20 +55,103 @@ class WebBoilerParameter(dict):
         else:
             self.update_callbacks[update_key] = update_callback
 
-    async def update(self, name, value, timestamp = None):
+    async def update(self, name, value, timestamp = None, notify = True):
+        if self.get("value") != value:
+            self.version = next_parameter_version()
         self["name"] = name
         self["value"] = value
         self["timestamp"] = timestamp
-        await self.notify_updated()
+        if notify:
+            await self.notify_updated()
 
     async def notify_updated(self):
         for callback in self.update_callbacks.values():
             await callback(self)
 
+class WebBoilerCompactParameter(MutableMapping):
+    # Same interface as WebBoilerParameter, but fields are kept in slots and
+    # callbacks/extra keys are allocated only when used
+    __slots__ = ("name", "value", "timestamp", "update_callbacks", "extra", "version")
+    fields = ("name", "value", "timestamp")
+
+    def __init__(self, name = None, value = None, timestamp = None):
+        self.name = name
+        self.value = value
+        self.timestamp = timestamp
+        self.update_callbacks = None
+        self.extra = None
+        self.version = next_parameter_version()
+
+    def __getitem__(self, key):
+        if key in WebBoilerCompactParameter.fields:
+            return getattr(self, key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in WebBoilerCompactParameter.fields:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = dict()
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in WebBoilerCompactParameter.fields:
+            setattr(self, key, None)
+        elif self.extra is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        yield from WebBoilerCompactParameter.fields
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return len(WebBoilerCompactParameter.fields) + (0 if self.extra is None else len(self.extra))
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def set_update_callback(self, update_callback, update_key = "default"):
+        if update_callback == None:
+            if self.update_callbacks is not None and update_key in self.update_callbacks.keys():
+                del self.update_callbacks[update_key]
+                if len(self.update_callbacks) == 0:
+                    self.update_callbacks = None
+        else:
+            if self.update_callbacks is None:
+                self.update_callbacks = dict()
+            self.update_callbacks[update_key] = update_callback
+
+    async def update(self, name, value, timestamp = None, notify = True):
+        if self.value != value:
+            self.version = next_parameter_version()
+        self.name = name
+        self.value = value
+        self.timestamp = timestamp
+        if notify:
+            await self.notify_updated()
+
+    async def notify_updated(self):
+        if self.update_callbacks is None:
+            return
+        for callback in list(self.update_callbacks.values()):
+            await callback(self)
+
 class WebBoilerDevice(dict):
-    def __init__(self, username):
+    def __init__(self, username, parameter_class = WebBoilerParameter):
         self.logger = logging.getLogger(__name__)
         self.username = username
+        self.parameter_class = parameter_class
+        self.history = None
+        self.change_filter = None
         self["parameters"] = {}
         self["temperatures"] = {}
         self["info"] = {}
@@ -46,7 +163,7 @@ class WebBoilerDevice(dict):
         return name in self["parameters"].keys()
 
     def create_parameter(self, name, value = "?"):
-        self["parameters"][name] = WebBoilerParameter()
+        self["parameters"][name] = self.parameter_class()
         self["parameters"][name]["name"] = name
         self["parameters"][name]["value"] = value
         return self["parameters"][name]
@@ -68,23 +185,40 @@ class WebBoilerDevice(dict):
                 return widget
         return None
 
-    async def update_parameter(self, name, value, timestamp = None) -> WebBoilerParameter:
+    async def update_parameter(self, name, value, timestamp = None):
         if timestamp == None:
             timestamp = int(time.time())
         else:
-            date_time_obj = datetime.datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-            timestamp = int(date_time_obj.replace(tzinfo=datetime.timezone.utc).timestamp())
+            timestamp = parse_timestamp(timestamp)
+        # with change filter, None is returned when update is stored but not notified
         parameter = self.get_or_create_parameter(name)
-        await parameter.update(name, value, timestamp)
-        return parameter
+        notify = self.change_filter is None or self.change_filter.should_notify(self["serial"], name, value)
+        await parameter.update(name, value, timestamp, notify)
+        if self.history is not None:
+            self.history.record(self["serial"], name, value, timestamp)
+        return parameter if notify else None
 
 
 class WebBoilerDeviceCollection(dict):
 
-    def __init__(self, username, on_update_callback = None, update_key = "default"):
+    def __init__(self, username, on_update_callback = None, update_key = "default", compact_parameters = False):
         self.logger = logging.getLogger(__name__)
         self.username = username
+        self.parameter_class = WebBoilerCompactParameter if compact_parameters else WebBoilerParameter
         self.on_update_callbacks = dict()
+        self.on_batch_update_callbacks = dict()
+        self.batch_window = 0
+        self.pending_batches = dict()
+        self.batch_flush_task = None
+        self.devices_by_id = dict()
+        self.devices_by_serial = dict()
+        # parameter version last delivered by notify_all_updated, per callback key
+        self.watermarks = dict()
+        self.notify_chunk_size = 500
+        self.history = None
+        self.interest = None
+        self.change_filter = None
+        self.metrics = None
         self.set_on_update_callback(on_update_callback, update_key)
 
     def set_on_update_callback(self, on_update_callback, update_key = "default"):
@@ -94,51 +228,237 @@ class WebBoilerDeviceCollection(dict):
         else:
             self.on_update_callbacks[update_key] = on_update_callback
 
-    async def notify_all_updated(self):
-        for on_update_callback in self.on_update_callbacks.values():
-            for device in self.values():
-                parameters = device["parameters"]
-                for parameter in parameters.values():
-                    await on_update_callback(device, parameter, True)
-                    await parameter.notify_updated()
+    # on_batch_update_callback(device, {name: parameter}, create = False) is called once
+    # per frame (or once per batch window) instead of once per updated parameter
+    def set_on_batch_update_callback(self, on_batch_update_callback, update_key = "default"):
+        if on_batch_update_callback == None:
+            if update_key in self.on_batch_update_callbacks.keys():
+                del self.on_batch_update_callbacks[update_key]
+        else:
+            self.on_batch_update_callbacks[update_key] = on_batch_update_callback
 
-    def get_device_by_id(self, id):
+    # Collect updates for batch_window seconds before calling batch callbacks, 0 dispatches every frame
+    def set_batch_window(self, batch_window):
+        self.batch_window = batch_window
+
+    # Record parameter updates of all devices into WebBoilerHistory, None stops recording
+    def set_history(self, history):
+        self.history = history
         for device in self.values():
-            if str(id) == str(device["id"]):
-                return device
-        raise Exception(f"No device with id:{id}")
+            device.history = history
 
-    def get_device_by_serial(self, serial):
+    # Real time and reconciled updates of parameters outside WebBoilerInterestSet are dropped
+    # before they are stored or dispatched, None accepts every parameter. Full status parsing
+    # is not filtered, so every parameter still has its initial value.
+    def set_interest(self, interest):
+        self.interest = interest
+
+    # Parameter callbacks and collection callbacks get only updates passed by WebBoilerChangeFilter,
+    # None notifies every update
+    def set_change_filter(self, change_filter):
+        self.change_filter = change_filter
+        if change_filter is not None:
+            change_filter.deliver_callback = self.__deliver_throttled_update
         for device in self.values():
-            if str(serial) == str(device["serial"]):
-                return device
-        raise Exception(f"No device with serial:{serial}")
+            device.change_filter = change_filter
+
+    def reset_watermarks(self):
+        self.watermarks = dict()
+
+    def get_changed_parameters(self, version):
+        # {serial: (device, {name: parameter})} of parameters changed after version
+        changed = dict()
+        for serial, device in list(self.items()):
+            parameters = {name: parameter for name, parameter in list(device["parameters"].items()) if parameter.version > version}
+            if len(parameters) > 0:
+                changed[serial] = (device, parameters)
+        return changed
+
+    async def notify_all_updated(self, full = False):
+        # Every consumer (update callback key, batch callback key and per parameter callbacks)
+        # gets only parameters changed since its previous notify_all_updated, first call or
+        # full=True delivers everything. Loop is yielded to after every notify_chunk_size callbacks.
+        version = current_parameter_version()
+        consumers = []
+        for update_key, callback in list(self.on_update_callbacks.items()):
+            consumers.append((("update", update_key), callback, False))
+        consumers.append((("parameter", None), None, False))
+        for update_key, callback in list(self.on_batch_update_callbacks.items()):
+            consumers.append((("batch", update_key), callback, True))
+        changes = dict()
+        calls = 0
+        for consumer, callback, batch in consumers:
+            watermark = 0 if full else self.watermarks.get(consumer, 0)
+            if watermark not in changes:
+                changes[watermark] = self.get_changed_parameters(watermark)
+            for device, parameters in changes[watermark].values():
+                if batch:
+                    await callback(device, parameters, True)
+                    calls += 1
+                    if calls % self.notify_chunk_size == 0:
+                        await asyncio.sleep(0)
+                else:
+                    for parameter in parameters.values():
+                        if callback is None:
+                            await parameter.notify_updated()
+                        else:
+                            await callback(device, parameter, True)
+                        calls += 1
+                        if calls % self.notify_chunk_size == 0:
+                            await asyncio.sleep(0)
+            self.watermarks[consumer] = version
+        return calls
+
+    def __queue_batch(self, device, parameters):
+        serial = device["serial"]
+        if serial in self.pending_batches:
+            # same parameter updated again in the window, keep only the latest one
+            self.pending_batches[serial][1].update(parameters)
+        else:
+            self.pending_batches[serial] = (device, parameters)
+
+    async def flush_batches(self):
+        pending_batches = self.pending_batches
+        self.pending_batches = dict()
+        for device, parameters in pending_batches.values():
+            for on_batch_update_callback in self.on_batch_update_callbacks.values():
+                await on_batch_update_callback(device, parameters)
+
+    async def __flush_batches_later(self):
+        try:
+            await asyncio.sleep(self.batch_window)
+            self.batch_flush_task = None
+            await self.flush_batches()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"WebBoilerDeviceCollection::flush_batches failed {e} ({self.username})")
+
+    def get_device_by_id(self, id):
+        device = self.devices_by_id.get(str(id))
+        if device is None:
+            raise Exception(f"No device with id:{id}")
+        return device
+
+    def get_device_by_serial(self, serial):
+        device = self.devices_by_serial.get(str(serial))
+        if device is None:
+            raise Exception(f"No device with serial:{serial}")
+        return device
+
+    def index_device(self, device):
+        previous = self.devices_by_serial.get(str(device["serial"]))
+        if previous is not None:
+            self.devices_by_id.pop(str(previous["id"]), None)
+        self.devices_by_id[str(device["id"])] = device
+        self.devices_by_serial[str(device["serial"])] = device
 
     def parse_installations(self, installations : dict()):
         for device in installations:
             serial = device["label"]
             self.logger.info(f"Creating device {serial} ({self.username})")
-            self[serial] = WebBoilerDevice(self.username)
+            self[serial] = WebBoilerDevice(self.username, self.parameter_class)
             self[serial]["id"] = device["value"]
             self[serial]["serial"] = device["label"]
             self[serial]["place"] = device["place"]
             self[serial]["address"] = device["address"]
             self[serial]["type"] = device["type"]
             self[serial]["product"] = device["product"]
+            self[serial].history = self.history
+            self[serial].change_filter = self.change_filter
+            self.index_device(self[serial])
+
+    def create_snapshot(self):
+        snapshot = dict()
+        for serial, device in self.items():
+            device_snapshot = dict()
+            for key, value in device.items():
+                if key == "parameters":
+                    parameters = dict()
+                    for name, parameter in value.items():
+                        parameters[name] = [parameter["value"], parameter.get("timestamp")]
+                    device_snapshot[key] = parameters
+                else:
+                    device_snapshot[key] = value
+            snapshot[serial] = device_snapshot
+        return snapshot
+
+    def restore_snapshot(self, snapshot):
+        for serial, device_snapshot in snapshot.items():
+            self.logger.info(f"Restoring device {serial} ({self.username})")
+            device = WebBoilerDevice(self.username, self.parameter_class)
+            device.history = self.history
+            device.change_filter = self.change_filter
+            for key, value in device_snapshot.items():
+                if key == "parameters":
+                    for name, (parameter_value, timestamp) in value.items():
+                        parameter = device.create_parameter(name, parameter_value)
+                        if timestamp is not None:
+                            parameter["timestamp"] = timestamp
+                elif key in DEVICE_LIST_INDEX_KEYS:
+                    # json turned keys into strings, index them again by the item field they came from
+                    index_key = DEVICE_LIST_INDEX_KEYS[key]
+                    device[key] = {item[index_key]: item for item in value.values()}
+                else:
+                    device[key] = value
+            self[serial] = device
+            self.index_device(device)
+
+    def create_installation_status(self):
+        # current statuses in installation-status-all form, parse_installation_statuses restores them
+        installation_status_all = dict()
+        for device in self.values():
+            params = dict()
+            for name, parameter in device["parameters"].items():
+                timestamp = parameter.get("timestamp")
+                params[name] = {"v": parameter["value"], "ut": None if timestamp is None else format_timestamp(timestamp)}
+            status = dict()
+            if "country" in device:
+                status["installation"] = {"country": device["country"], "countryCode": device["countryCode"]}
+            status["params"] = params
+            installation_status_all[str(device["id"])] = status
+        return installation_status_all
 
     async def parse_installation_statuses(self, installation_status_all : dict()):
         for device_id, value in installation_status_all.items():
-            device = self.get_device_by_id(device_id)
-            for group, data in value.items():
-                if group == "installation":
-                    device["country"] = data["country"]
-                    device["countryCode"] = data["countryCode"]
-                elif group == "params":
-                    for param_id, param_data in data.items():
-                        await device.update_parameter(param_id, param_data["v"], param_data["ut"])
-                else:
-                    raise Exception(f"Unknown group in installation_status_all group:{group}")
-            
+            await self.parse_installation_status(device_id, value)
+
+    async def parse_installation_status(self, device_id, value : dict()):
+        device = self.get_device_by_id(device_id)
+        for group, data in value.items():
+            if group == "installation":
+                device["country"] = data["country"]
+                device["countryCode"] = data["countryCode"]
+            elif group == "params":
+                for param_id, param_data in data.items():
+                    await device.update_parameter(param_id, param_data["v"], param_data["ut"])
+            else:
+                raise Exception(f"Unknown group in installation_status_all group:{group}")
+
+    async def reconcile_installation_statuses(self, installation_status_all : dict()):
+        changed = 0
+        for device_id, value in installation_status_all.items():
+            changed += await self.reconcile_installation_status(device_id, value)
+        return changed
+
+    async def reconcile_installation_status(self, device_id, value : dict()):
+        # like parse_installation_status, but only parameters whose value differs are updated
+        # and reported to callbacks, used to catch up after websocket reconnect
+        device = self.get_device_by_id(device_id)
+        updated = dict()
+        interest = self.interest
+        for param_id, param_data in value.get("params", {}).items():
+            if interest is not None and not interest.matches(device["serial"], param_id):
+                interest.skipped += 1
+                continue
+            if device.has_parameter(param_id) and device["parameters"][param_id]["value"] == param_data["v"]:
+                continue
+            parameter = await device.update_parameter(param_id, param_data["v"], param_data["ut"])
+            if parameter is not None:
+                updated[param_id] = parameter
+        await self.__notify_device_updated(device, updated)
+        return len(updated)
+
     def parse_parameter_lists(self, parameter_list):
         for serial, device_data in parameter_list.items():
             device = self.get_device_by_serial(serial)
@@ -181,12 +501,51 @@ class WebBoilerDeviceCollection(dict):
                 device["widgets"][widget["id"]] = widget
 
     async def _update_device_with_real_time_data(self, device, body):
+        if isinstance(body, memoryview):
+            body = body.tobytes()
         data = json.loads(body)
+        updated = dict()
+        interest = self.interest
         for param_id, value in data.items():
+            if interest is not None and not interest.matches(device["serial"], param_id):
+                interest.skipped += 1
+                continue
             if device.has_parameter(param_id):
                 parameter = await device.update_parameter(param_id, value)
-                for on_update_callback in self.on_update_callbacks.values():
-                    await on_update_callback(device, parameter)
+                if parameter is not None:
+                    updated[param_id] = parameter
+        await self.__notify_device_updated(device, updated)
+
+    async def __deliver_throttled_update(self, serial, name):
+        # called by change filter when min_interval of a held back update ends
+        device = self.devices_by_serial.get(str(serial))
+        if device is None or not device.has_parameter(name):
+            return
+        parameter = device["parameters"][name]
+        if not self.change_filter.accept_pending(serial, name, parameter["value"]):
+            return
+        await parameter.notify_updated()
+        await self.__notify_device_updated(device, {name: parameter})
+
+    async def __notify_device_updated(self, device, updated):
+        if self.metrics is None or len(updated) == 0:
+            await self.__run_device_callbacks(device, updated)
+            return
+        start = time.perf_counter()
+        await self.__run_device_callbacks(device, updated)
+        self.metrics.callback_duration.observe(time.perf_counter() - start, (self.username,))
+
+    async def __run_device_callbacks(self, device, updated):
+        for parameter in updated.values():
+            for on_update_callback in self.on_update_callbacks.values():
+                await on_update_callback(device, parameter)
+        if len(updated) == 0 or len(self.on_batch_update_callbacks) == 0:
+            return
+        self.__queue_batch(device, updated)
+        if self.batch_window <= 0:
+            await self.flush_batches()
+        elif self.batch_flush_task is None:
+            self.batch_flush_task = asyncio.get_running_loop().create_task(self.__flush_batches_later())
 
     async def parse_real_time_frame(self, stomp_frame):
         if "headers" in stomp_frame and "body" in stomp_frame:
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import os
+import gzip
+import json
+import mmap
+import time
+import struct
+import shutil
+import asyncio
+import logging
+
+from centrometal_web_boiler.StompFrameParser import StompFrameParser
+
+# file starts with magic, then records of header (receive time, kind, payload length) and payload
+FRAME_FILE_MAGIC = b"WBFRAME1"
+FRAME_RECORD_HEADER = struct.Struct("<dBI")
+FRAME_KIND_TEXT = 0
+FRAME_KIND_BINARY = 1
+FRAME_KIND_SNAPSHOT = 2
+
+
+class WebBoilerFrameRecorder:
+    # Appends raw websocket messages with receive timestamps to prefix-<time>-<sequence>.wbf
+    # files in path. A file is rotated when it grows over max_bytes, only max_files newest
+    # files are kept (None keeps all) and rotated files are gzipped in a worker thread when
+    # compress is set. Device snapshot given to record_snapshot is repeated at the start of
+    # every file, so each file can be replayed offline on its own.
+    def __init__(self, path, prefix = "frames", max_bytes = 64 * 1024 * 1024, max_files = None, compress = False, buffer_size = 256 * 1024):
+        self.logger = logging.getLogger(__name__)
+        self.path = path
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.compress = compress
+        self.buffer_size = buffer_size
+        self.file = None
+        self.filename = None
+        self.size = 0
+        self.sequence = 0
+        self.snapshot = None
+        self.records = 0
+        self.bytes = 0
+        self.rotations = 0
+        self.compress_tasks = set()
+
+    def get_files(self):
+        # recorded files oldest first, compressed or not
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        names = [name for name in names if name.startswith(self.prefix + "-") and (name.endswith(".wbf") or name.endswith(".wbf.gz"))]
+        return [os.path.join(self.path, name) for name in sorted(names)]
+
+    def __open(self):
+        os.makedirs(self.path, exist_ok=True)
+        self.sequence += 1
+        name = f"{self.prefix}-{time.strftime('%Y%m%d-%H%M%S')}-{self.sequence:04d}.wbf"
+        self.filename = os.path.join(self.path, name)
+        self.file = open(self.filename, "ab", buffering=self.buffer_size)
+        self.file.write(FRAME_FILE_MAGIC)
+        self.size = len(FRAME_FILE_MAGIC)
+        if self.snapshot is not None:
+            self.__write(time.time(), FRAME_KIND_SNAPSHOT, self.snapshot)
+
+    def __write(self, timestamp, kind, payload):
+        self.file.write(FRAME_RECORD_HEADER.pack(timestamp, kind, len(payload)))
+        self.file.write(payload)
+        self.size += FRAME_RECORD_HEADER.size + len(payload)
+
+    def record(self, data, timestamp = None):
+        if isinstance(data, str):
+            kind = FRAME_KIND_TEXT
+            payload = data.encode()
+        else:
+            kind = FRAME_KIND_BINARY
+            payload = bytes(data)
+        if self.file is None:
+            self.__open()
+        elif self.size >= self.max_bytes:
+            self.rotate()
+        self.__write(time.time() if timestamp is None else timestamp, kind, payload)
+        self.records += 1
+        self.bytes += len(payload)
+
+    def record_snapshot(self, username, devices):
+        # devices is WebBoilerDeviceCollection.create_snapshot()
+        self.snapshot = json.dumps({"username": username, "devices": devices}).encode()
+        if self.file is None:
+            self.__open()
+        else:
+            self.__write(time.time(), FRAME_KIND_SNAPSHOT, self.snapshot)
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+
+    def __close_file(self, background):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        if self.compress:
+            filename = self.filename
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                loop = None
+            if background and loop is not None:
+                task = loop.run_in_executor(None, WebBoilerFrameRecorder.compress_file, filename)
+                self.compress_tasks.add(task)
+                task.add_done_callback(self.__on_compressed)
+            else:
+                WebBoilerFrameRecorder.compress_file(filename)
+        self.__remove_old_files()
+
+    def __on_compressed(self, task):
+        self.compress_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.error(f"WebBoilerFrameRecorder - compression failed {task.exception()}")
+        self.__remove_old_files()
+
+    def __remove_old_files(self):
+        if self.max_files is None:
+            return
+        files = [filename for filename in self.get_files() if filename != self.filename or self.file is None]
+        for filename in files[:max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def compress_file(filename):
+        with open(filename, "rb") as source, gzip.open(filename + ".tmp", "wb", compresslevel=6) as target:
+            shutil.copyfileobj(source, target, 1024 * 1024)
+        os.replace(filename + ".tmp", filename + ".gz")
+        os.remove(filename)
+
+    def rotate(self):
+        self.__close_file(True)
+        self.rotations += 1
+        self.__open()
+
+    def close(self):
+        self.__close_file(False)
+
+    async def wait_compressed(self):
+        if len(self.compress_tasks) > 0:
+            await asyncio.gather(*list(self.compress_tasks), return_exceptions=True)
+
+    def get_stats(self):
+        return {
+            "records": self.records,
+            "bytes": self.bytes,
+            "rotations": self.rotations,
+            "file": self.filename,
+            "file_size": self.size,
+        }
+
+
+def read_frame_records(filename):
+    # yields (timestamp, kind, payload) of one recorded file, plain files are memory mapped and
+    # gzipped files are streamed, so neither is loaded whole; truncated last record is ignored
+    if filename.endswith(".gz"):
+        with gzip.open(filename, "rb") as f:
+            if f.read(len(FRAME_FILE_MAGIC)) != FRAME_FILE_MAGIC:
+                raise Exception(f"Not a frame recording: {filename}")
+            while True:
+                header = f.read(FRAME_RECORD_HEADER.size)
+                if len(header) < FRAME_RECORD_HEADER.size:
+                    return
+                timestamp, kind, length = FRAME_RECORD_HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length:
+                    return
+                yield timestamp, kind, payload
+        return
+    with open(filename, "rb") as f:
+        if os.fstat(f.fileno()).st_size < len(FRAME_FILE_MAGIC):
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(FRAME_FILE_MAGIC)] != FRAME_FILE_MAGIC:
+                raise Exception(f"Not a frame recording: {filename}")
+            position = len(FRAME_FILE_MAGIC)
+            size = len(data)
+            unpack_from = FRAME_RECORD_HEADER.unpack_from
+            header_size = FRAME_RECORD_HEADER.size
+            while position + header_size <= size:
+                timestamp, kind, length = unpack_from(data, position)
+                position += header_size
+                if position + length > size:
+                    return
+                yield timestamp, kind, data[position:position + length]
+                position += length
+
+
+class WebBoilerFrameReplay:
+    # Feeds recorded messages through StompFrameParser and parse_real_time_frame of collection,
+    # the same path websocket messages take. speed None (or 0) replays as fast as possible,
+    # otherwise recorded gaps are divided by speed. Collection is restored from the first
+    # recorded snapshot when it has no devices, so replay does not need any connection.
+    def __init__(self, collection, speed = None, yield_every = 1000):
+        self.logger = logging.getLogger(__name__)
+        self.collection = collection
+        self.speed = speed
+        self.yield_every = yield_every
+        self.parser = StompFrameParser()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.records = 0
+        self.messages = 0
+        self.errors = 0
+        self.bytes = 0
+        self.elapsed = 0
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+    async def replay(self, filenames):
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        base = None
+        for filename in filenames:
+            self.parser.reset()
+            for timestamp, kind, payload in read_frame_records(filename):
+                if kind == FRAME_KIND_SNAPSHOT:
+                    if len(self.collection) == 0:
+                        self.collection.restore_snapshot(json.loads(bytes(payload))["devices"])
+                    continue
+                if self.first_timestamp is None:
+                    self.first_timestamp = timestamp
+                    base = loop.time()
+                self.last_timestamp = timestamp
+                if self.speed:
+                    delay = base + (timestamp - self.first_timestamp) / self.speed - loop.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                elif self.records % self.yield_every == 0:
+                    await asyncio.sleep(0)
+                self.records += 1
+                self.bytes += len(payload)
+                data = str(payload, "utf-8") if kind == FRAME_KIND_TEXT else bytes(payload)
+                try:
+                    for frame in self.parser.feed(data):
+                        if frame["cmd"] == "MESSAGE":
+                            self.messages += 1
+                            await self.collection.parse_real_time_frame(frame)
+                except Exception as e:
+                    self.errors += 1
+                    if self.errors <= 10:
+                        self.logger.warning(f"WebBoilerFrameReplay - {filename} record {self.records} failed {e}")
+        self.elapsed += loop.time() - started
+        return self.get_stats()
+
+    def get_stats(self):
+        elapsed = self.elapsed if self.elapsed > 0 else None
+        return {
+            "records": self.records,
+            "messages": self.messages,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "elapsed": self.elapsed,
+            "recorded_duration": 0 if self.first_timestamp is None else self.last_timestamp - self.first_timestamp,
+            "messages_per_second": None if elapsed is None else self.messages / elapsed,
+            "megabytes_per_second": None if elapsed is None else self.bytes / elapsed / 1024 / 1024,
+        }
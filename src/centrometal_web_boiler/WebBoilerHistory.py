@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import time
+import fnmatch
+import logging
+from array import array
+from typing import NamedTuple
+
+
+class WebBoilerHistoryBucket(NamedTuple):
+    start: float
+    min: float
+    max: float
+    avg: float
+    last: float
+    count: int
+
+
+class WebBoilerHistorySeries:
+    # Ring buffer of (timestamp, value) samples backed by two float arrays, 16 bytes per sample
+    # and never more than capacity samples. Samples are kept in timestamp order, so range
+    # queries locate their bounds by binary search instead of scanning.
+    __slots__ = ("capacity", "timestamps", "values", "start", "count", "dropped")
+
+    def __init__(self, capacity):
+        if capacity < 1:
+            raise ValueError(f"History capacity must be at least 1, got {capacity}")
+        self.capacity = capacity
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.start = 0
+        self.count = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, value):
+        if self.count > 0:
+            last = (self.start + self.count - 1) % self.capacity
+            if timestamp < self.timestamps[last]:
+                # late sample (e.g. status "ut" older than real time update) would break ordering
+                self.dropped += 1
+                return False
+            if timestamp == self.timestamps[last] and value == self.values[last]:
+                return False
+        if self.count < self.capacity:
+            position = (self.start + self.count) % self.capacity
+            self.count += 1
+        else:
+            position = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.timestamps[position] = timestamp
+        self.values[position] = value
+        return True
+
+    def last(self):
+        if self.count == 0:
+            return None
+        position = (self.start + self.count - 1) % self.capacity
+        return self.timestamps[position], self.values[position]
+
+    def __bisect(self, timestamp, right):
+        # first logical index whose timestamp is >= timestamp (> timestamp when right)
+        timestamps = self.timestamps
+        capacity = self.capacity
+        start = self.start
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            current = timestamps[(start + middle) % capacity]
+            if current < timestamp or (right and current == timestamp):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __range(self, start_time, end_time):
+        first = 0 if start_time is None else self.__bisect(start_time, False)
+        last = self.count if end_time is None else self.__bisect(end_time, True)
+        return first, last
+
+    def __positions(self, first, last):
+        # physical slices covering logical range [first, last)
+        begin = (self.start + first) % self.capacity
+        end = begin + (last - first)
+        if end <= self.capacity:
+            return [(begin, end)]
+        return [(begin, self.capacity), (0, end - self.capacity)]
+
+    def query(self, start_time = None, end_time = None):
+        # [(timestamp, value)] with start_time <= timestamp <= end_time
+        first, last = self.__range(start_time, end_time)
+        result = []
+        for begin, end in self.__positions(first, last):
+            result.extend(zip(self.timestamps[begin:end], self.values[begin:end]))
+        return result
+
+    def downsample(self, bucket, start_time = None, end_time = None):
+        # one WebBoilerHistoryBucket per bucket seconds that has samples, buckets are aligned to
+        # multiples of bucket so results of different series line up
+        if bucket <= 0:
+            raise ValueError(f"History bucket must be positive, got {bucket}")
+        first, last = self.__range(start_time, end_time)
+        buckets = []
+        current = None
+        for begin, end in self.__positions(first, last):
+            for timestamp, value in zip(self.timestamps[begin:end], self.values[begin:end]):
+                bucket_start = timestamp - timestamp % bucket
+                if current is not None and current[0] == bucket_start:
+                    if value < current[1]:
+                        current[1] = value
+                    if value > current[2]:
+                        current[2] = value
+                    current[3] += value
+                    current[4] = value
+                    current[5] += 1
+                else:
+                    if current is not None:
+                        buckets.append(WebBoilerHistory.make_bucket(current))
+                    current = [bucket_start, value, value, value, value, 1]
+        if current is not None:
+            buckets.append(WebBoilerHistory.make_bucket(current))
+        return buckets
+
+
+class WebBoilerHistory:
+    # Optional in-process history of parameter values. Attached to WebBoilerDeviceCollection,
+    # it records every numeric parameter update per (serial, parameter name) into a
+    # WebBoilerHistorySeries of at most capacity samples. Only parameters matching one of
+    # patterns (fnmatch, e.g. "PDT*") are tracked when patterns are given, max_series bounds
+    # the number of tracked parameters.
+    def __init__(self, capacity = 1440, patterns = None, max_series = None):
+        if capacity < 1:
+            raise ValueError(f"History capacity must be at least 1, got {capacity}")
+        self.logger = logging.getLogger(__name__)
+        self.capacity = capacity
+        self.patterns = None if patterns is None else list(patterns)
+        self.max_series = max_series
+        self.series = dict()
+        self.tracked = dict()
+        self.recorded = 0
+        self.skipped = 0
+
+    @staticmethod
+    def make_bucket(current):
+        bucket_start, minimum, maximum, total, last, count = current
+        return WebBoilerHistoryBucket(bucket_start, minimum, maximum, total / count, last, count)
+
+    @staticmethod
+    def to_number(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def is_tracked(self, name):
+        tracked = self.tracked.get(name)
+        if tracked is None:
+            tracked = self.patterns is None or any(fnmatch.fnmatchcase(name, pattern) for pattern in self.patterns)
+            self.tracked[name] = tracked
+        return tracked
+
+    def record(self, serial, name, value, timestamp = None):
+        if not self.is_tracked(name):
+            return False
+        number = WebBoilerHistory.to_number(value)
+        if number is None:
+            self.skipped += 1
+            return False
+        key = (serial, name)
+        series = self.series.get(key)
+        if series is None:
+            if self.max_series is not None and len(self.series) >= self.max_series:
+                self.skipped += 1
+                return False
+            series = WebBoilerHistorySeries(self.capacity)
+            self.series[key] = series
+        if series.append(time.time() if timestamp is None else timestamp, number):
+            self.recorded += 1
+            return True
+        return False
+
+    def get_series(self, serial, name):
+        return self.series.get((serial, name))
+
+    def get_names(self, serial):
+        return [name for series_serial, name in self.series.keys() if series_serial == serial]
+
+    def query(self, serial, name, start_time = None, end_time = None):
+        series = self.series.get((serial, name))
+        return [] if series is None else series.query(start_time, end_time)
+
+    def downsample(self, serial, name, bucket, start_time = None, end_time = None):
+        if bucket <= 0:
+            raise ValueError(f"History bucket must be positive, got {bucket}")
+        series = self.series.get((serial, name))
+        return [] if series is None else series.downsample(bucket, start_time, end_time)
+
+    def remove(self, serial, name = None):
+        for key in [key for key in self.series.keys() if key[0] == serial and (name is None or key[1] == name)]:
+            del self.series[key]
+
+    def clear(self):
+        self.series = dict()
+
+    def get_stats(self):
+        samples = sum(len(series) for series in self.series.values())
+        return {
+            "series": len(self.series),
+            "samples": samples,
+            "recorded": self.recorded,
+            "skipped": self.skipped,
+            "dropped": sum(series.dropped for series in self.series.values()),
+            "bytes": len(self.series) * self.capacity * 16,
+        }
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import fnmatch
+
+
+class WebBoilerInterestSet:
+    # Parameters consumers care about. Entries are exact parameter names or fnmatch patterns
+    # ("B_Tak*", "PWR ?"), registered for one device serial or for every device (serial None).
+    # Decisions are cached per (serial, name), so a lookup on the frame path is two dict gets.
+    def __init__(self, names = None, serial = None):
+        self.names = dict()
+        self.patterns = dict()
+        self.cache = dict()
+        self.skipped = 0
+        if names is not None:
+            self.add(names, serial)
+
+    @staticmethod
+    def is_pattern(name):
+        return any(c in name for c in "*?[")
+
+    def add(self, names, serial = None):
+        if isinstance(names, str):
+            names = [names]
+        for name in names:
+            if WebBoilerInterestSet.is_pattern(name):
+                patterns = self.patterns.setdefault(serial, [])
+                if name not in patterns:
+                    patterns.append(name)
+            else:
+                self.names.setdefault(serial, set()).add(name)
+        self.cache = dict()
+
+    def remove(self, names, serial = None):
+        if isinstance(names, str):
+            names = [names]
+        for name in names:
+            if name in self.patterns.get(serial, []):
+                self.patterns[serial].remove(name)
+            self.names.get(serial, set()).discard(name)
+        self.cache = dict()
+
+    def add_device(self, serial):
+        # every parameter of one device
+        self.add("*", serial)
+
+    def clear(self):
+        self.names = dict()
+        self.patterns = dict()
+        self.cache = dict()
+
+    def __match(self, serial, name):
+        for key in (None, serial):
+            if name in self.names.get(key, ()):
+                return True
+            for pattern in self.patterns.get(key, ()):
+                if fnmatch.fnmatchcase(name, pattern):
+                    return True
+        return False
+
+    def matches(self, serial, name):
+        device_cache = self.cache.get(serial)
+        if device_cache is None:
+            device_cache = self.cache[serial] = dict()
+        wanted = device_cache.get(name)
+        if wanted is None:
+            wanted = device_cache[name] = self.__match(serial, name)
+        return wanted
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import math
+import fnmatch
+import asyncio
+import logging
+import inspect
+from bisect import bisect_left
+from aiohttp import web
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+METRICS_DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_metric_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int) or (isinstance(value, float) and value.is_integer() and abs(value) < 1e15):
+        return str(int(value))
+    return repr(float(value))
+
+
+def format_metric_labels(labelnames, labels, extra = ""):
+    if len(labelnames) == 0:
+        return "{" + extra + "}" if extra else ""
+    pairs = []
+    for name, value in zip(labelnames, labels):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f"{name}=\"{value}\"")
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}"
+
+
+class MetricCounter:
+    type = "counter"
+
+    def __init__(self, name, help, labelnames = (), collected = False):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        # collected metrics are refilled by collectors on every render
+        self.collected = collected
+        self.values = dict()
+
+    def inc(self, amount = 1, labels = ()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set_total(self, value, labels = ()):
+        self.values[labels] = value
+
+    def render(self, lines):
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}_total{format_metric_labels(self.labelnames, labels)} {format_metric_value(value)}")
+
+
+class MetricGauge:
+    type = "gauge"
+
+    def __init__(self, name, help, labelnames = (), collected = False):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collected = collected
+        self.values = dict()
+
+    def set(self, value, labels = ()):
+        self.values[labels] = value
+
+    def inc(self, amount = 1, labels = ()):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self, lines):
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{format_metric_labels(self.labelnames, labels)} {format_metric_value(value)}")
+
+
+class MetricHistogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames = (), buckets = METRICS_DEFAULT_BUCKETS, collected = False):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.collected = collected
+        # labels -> [count per bucket (last one is +Inf), sum]
+        self.values = dict()
+
+    def observe(self, value, labels = ()):
+        data = self.values.get(labels)
+        if data is None:
+            data = self.values[labels] = [[0] * (len(self.buckets) + 1), 0]
+        data[0][bisect_left(self.buckets, value)] += 1
+        data[1] += value
+
+    def render(self, lines):
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for upper, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = "le=\"" + format_metric_value(upper if upper == math.inf else float(upper)) + "\""
+                lines.append(f"{self.name}_bucket{format_metric_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_count{format_metric_labels(self.labelnames, labels)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_metric_labels(self.labelnames, labels)} {format_metric_value(total)}")
+
+
+class WebBoilerMetrics:
+    # Metrics registry rendered in OpenMetrics text format. Hot paths (HTTP requests, websocket
+    # messages, dispatch queue, frame processing, callbacks) observe only when client was given
+    # metrics, everything else (endpoint stats, reconnects, queue depth, devices and parameter
+    # values) is read from existing stats by collectors when metrics are rendered. Rendered text
+    # is served by start_server on local HTTP endpoint and/or passed to sinks by push.
+    def __init__(self, parameters = True, parameter_patterns = None, buckets = METRICS_DEFAULT_BUCKETS):
+        self.logger = logging.getLogger(__name__)
+        self.parameters = parameters
+        self.parameter_patterns = None if parameter_patterns is None else list(parameter_patterns)
+        self.parameter_tracked = dict()
+        self.metrics = dict()
+        self.collectors = []
+        self.clients = []
+        self.sinks = []
+        self.runner = None
+        self.push_task = None
+        account = ("account",)
+        self.http_request_duration = self.histogram(
+            "centrometal_http_request_duration_seconds", "Duration of successful HTTP requests.", account + ("endpoint",), buckets)
+        self.ws_messages = self.counter("centrometal_ws_messages", "Received websocket messages.", account)
+        self.ws_bytes = self.counter("centrometal_ws_received_bytes", "Received websocket bytes.", account)
+        self.dispatch_latency = self.histogram(
+            "centrometal_dispatch_latency_seconds", "Time messages waited in dispatch queue.", account, buckets)
+        self.frame_duration = self.histogram(
+            "centrometal_frame_processing_seconds", "Duration of real time frame processing including callbacks.", account, buckets)
+        self.callback_duration = self.histogram(
+            "centrometal_callback_duration_seconds", "Duration of collection callbacks per updated device.", account, buckets)
+        self.http_requests = self.counter("centrometal_http_requests", "HTTP requests.", account + ("endpoint",), True)
+        self.http_errors = self.counter("centrometal_http_errors", "Failed HTTP requests.", account + ("endpoint",), True)
+        self.http_retries = self.counter("centrometal_http_retries", "Retried HTTP requests.", account + ("endpoint",), True)
+        self.http_timeouts = self.counter("centrometal_http_timeouts", "Timed out HTTP requests.", account + ("endpoint",), True)
+        self.http_relogins = self.counter("centrometal_http_relogins", "Logins after expired session.", account, True)
+        self.http_circuit_open = self.gauge("centrometal_http_circuit_open", "1 when HTTP circuit breaker is open.", account, True)
+        self.ws_connected = self.gauge("centrometal_ws_connected", "1 when websocket is connected.", account, True)
+        self.ws_connections = self.counter("centrometal_ws_connections", "Established STOMP connections.", account, True)
+        self.ws_reconnects = self.counter("centrometal_ws_reconnects", "Websocket reconnect attempts.", account, True)
+        self.dispatch_depth = self.gauge("centrometal_dispatch_queue_depth", "Messages waiting in dispatch queue.", account, True)
+        self.dispatch_dropped = self.counter("centrometal_dispatch_dropped", "Messages dropped by dispatch queue.", account, True)
+        self.devices = self.gauge("centrometal_devices", "Known devices.", account, True)
+        self.parameter_count = self.gauge("centrometal_parameters", "Known parameters.", account + ("serial",), True)
+        self.parameter_value = self.gauge(
+            "centrometal_parameter_value", "Numeric parameter values.", account + ("serial", "parameter"), True)
+        self.add_collector(self.__collect_clients)
+
+    def __register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labelnames = (), collected = False):
+        return self.__register(MetricCounter(name, help, labelnames, collected))
+
+    def gauge(self, name, help, labelnames = (), collected = False):
+        return self.__register(MetricGauge(name, help, labelnames, collected))
+
+    def histogram(self, name, help, labelnames = (), buckets = METRICS_DEFAULT_BUCKETS, collected = False):
+        return self.__register(MetricHistogram(name, help, labelnames, buckets, collected))
+
+    def add_collector(self, collector):
+        # collector(metrics) fills collected metrics just before rendering
+        self.collectors.append(collector)
+
+    def add_client(self, client):
+        if client not in self.clients:
+            self.clients.append(client)
+
+    def remove_client(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+
+    def is_parameter_tracked(self, name):
+        tracked = self.parameter_tracked.get(name)
+        if tracked is None:
+            tracked = self.parameter_patterns is None or any(fnmatch.fnmatchcase(name, pattern) for pattern in self.parameter_patterns)
+            self.parameter_tracked[name] = tracked
+        return tracked
+
+    def __collect_clients(self, metrics):
+        for client in list(self.clients):
+            http_client = getattr(client, "http_client", None)
+            if http_client is None:
+                continue
+            account = (http_client.username,)
+            for endpoint, stats in list(http_client.endpoint_stats.items()):
+                labels = account + (endpoint,)
+                self.http_requests.set_total(stats.requests, labels)
+                self.http_errors.set_total(stats.errors, labels)
+                self.http_retries.set_total(stats.retries, labels)
+                self.http_timeouts.set_total(stats.timeouts, labels)
+            self.http_relogins.set_total(http_client.relogins, account)
+            self.http_circuit_open.set(http_client.circuit_breaker.state == "open", account)
+            ws_client = client.ws_client
+            self.ws_connected.set(client.is_websocket_connected(), account)
+            self.ws_connections.set_total(ws_client.connected_count, account)
+            self.ws_reconnects.set_total(ws_client.reconnects, account)
+            dispatch = ws_client.get_dispatch_stats()
+            self.dispatch_depth.set(dispatch["depth"], account)
+            self.dispatch_dropped.set_total(dispatch["dropped"], account)
+            self.devices.set(len(client.data), account)
+            for serial, device in list(client.data.items()):
+                parameters = device["parameters"]
+                self.parameter_count.set(len(parameters), account + (serial,))
+                if not self.parameters:
+                    continue
+                for name, parameter in list(parameters.items()):
+                    if not self.is_parameter_tracked(name):
+                        continue
+                    try:
+                        value = float(parameter["value"])
+                    except (TypeError, ValueError):
+                        continue
+                    if math.isfinite(value):
+                        self.parameter_value.set(value, account + (serial, name))
+
+    def render(self):
+        for metric in self.metrics.values():
+            if metric.collected:
+                metric.values = dict()
+        for collector in self.collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                self.logger.error(f"WebBoilerMetrics - collector failed {e!r}")
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            metric.render(lines)
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def add_sink(self, sink):
+        # sink(text) is called (awaited when coroutine function) by push
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+
+    async def push(self):
+        if len(self.sinks) == 0:
+            return
+        text = self.render()
+        for sink in list(self.sinks):
+            try:
+                result = sink(text)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                self.logger.error(f"WebBoilerMetrics - sink failed {e!r}")
+
+    def start_push(self, interval = 15):
+        async def push_periodically():
+            while True:
+                await asyncio.sleep(interval)
+                await self.push()
+
+        self.push_task = asyncio.get_running_loop().create_task(push_periodically())
+
+    async def start_server(self, host = "127.0.0.1", port = 9464):
+        async def handle_metrics(request):
+            return web.Response(body=self.render().encode(), headers={"Content-Type": OPENMETRICS_CONTENT_TYPE})
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        self.logger.info(f"WebBoilerMetrics - serving http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self.push_task is not None:
+            self.push_task.cancel()
+            try:
+                await self.push_task
+            except asyncio.CancelledError:
+                pass
+            self.push_task = None
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import logging
+import asyncio
+import json
+import random
+import time
+import uuid
+import stomper
+from aiohttp import web
+
+from centrometal_web_boiler.ws import ServerSocket
+from centrometal_web_boiler.const import WEB_BOILER_STOMP_DEVICE_TOPIC
+
+MOCK_PARAMETER_NAMES = [
+    "B_Tak1_1", "B_Tak2_1", "B_Tdpl1", "B_Tpov1", "B_Tptv1", "B_Tk1", "B_Tk2",
+    "B_STATE", "B_fan", "B_Oxy1", "B_puz", "B_zlj", "PWR 1", "PWR 2",
+]
+
+
+class WebBoilerMockServer:
+    def __init__(self, devices = 1, parameters = 50, rate = 10, parameters_per_frame = 5,
+                 host = "localhost", http_port = 8080, ws_port = 15674, device_type = "peltec", heart_beat = (0, 0),
+                 http_latency = 0):
+        self.logger = logging.getLogger(__name__)
+        self.host = host
+        self.http_port = http_port
+        self.ws_port = ws_port
+        self.rate = rate
+        self.parameters_per_frame = parameters_per_frame
+        # STOMP heart-beat (send, receive) in milliseconds offered in CONNECTED frame
+        self.heart_beat = heart_beat
+        self.heart_beat_task = None
+        # seconds added to every HTTP response, simulates round trip to real server
+        self.http_latency = http_latency
+        self.csrf_token = uuid.uuid4().hex
+        self.sessions = set()
+        self.subscriptions = dict()
+        self.message_index = 0
+        self.frames_sent = 0
+        self.http_requests = 0
+        self.control_requests = 0
+        self.runner = None
+        self.ws_server = None
+        self.publish_task = None
+        self.devices = dict()
+        parameter_names = MOCK_PARAMETER_NAMES[:parameters]
+        for i in range(len(parameter_names), parameters):
+            parameter_names.append(f"PRD {i}")
+        for i in range(0, devices):
+            id = 1000 + i
+            self.devices[id] = {
+                "id": id,
+                "serial": f"MOCK{i:06d}",
+                "type": device_type,
+                "parameters": {name: str(random.randint(0, 100)) for name in parameter_names},
+            }
+        self.socket = ServerSocket()
+        self.socket.set_listener("message", self.__on_ws_message)
+        self.socket.set_listener("disconnect", self.__on_ws_disconnect)
+        self.socket.set_listener("close", self.__on_ws_disconnect)
+
+    @property
+    def webroot(self):
+        return f"http://{self.host}:{self.http_port}"
+
+    @property
+    def stomp_url(self):
+        return f"ws://{self.host}:{self.ws_port}/ws"
+
+    def get_device_by_serial(self, serial):
+        for device in self.devices.values():
+            if device["serial"] == serial:
+                return device
+        raise Exception(f"No device with serial:{serial}")
+
+    async def start(self):
+        app = web.Application(middlewares=[self.__latency] if self.http_latency > 0 else [])
+        app.router.add_get("/login", self.__login)
+        app.router.add_post("/login_check", self.__login_check)
+        app.router.add_post("/notifications/data/get", self.__notifications)
+        app.router.add_post("/data/autocomplete/installation", self.__installations)
+        app.router.add_post("/api/configuration", self.__configuration)
+        app.router.add_post("/api/widgets-grid/list", self.__widgetgrid_list)
+        app.router.add_post("/api/widgets-grid", self.__widgetgrid)
+        app.router.add_post("/wdata/data/installation-status-all", self.__installation_status_all)
+        app.router.add_post("/wdata/data/parameter-list/{serial}", self.__parameter_list)
+        app.router.add_post("/api/inst/control/multiple", self.__control_multiple)
+        app.router.add_post("/api/inst/control/advanced/{id}", self.__control_advanced)
+        app.router.add_post("/api/inst/control/{id}", self.__control)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.http_port)
+        await site.start()
+        self.ws_server = await self.socket.serve(self.host, self.ws_port)
+        if self.rate > 0:
+            self.publish_task = asyncio.get_running_loop().create_task(self.__publish())
+        if self.heart_beat[0] > 0:
+            self.heart_beat_task = asyncio.get_running_loop().create_task(self.__send_heart_beats())
+        self.logger.info(f"WebBoilerMockServer - started {self.webroot} {self.stomp_url}")
+
+    async def stop(self):
+        if self.publish_task is not None:
+            self.publish_task.cancel()
+            self.publish_task = None
+        if self.heart_beat_task is not None:
+            self.heart_beat_task.cancel()
+            self.heart_beat_task = None
+        if self.ws_server is not None:
+            self.ws_server.close()
+            await self.ws_server.wait_closed()
+            self.ws_server = None
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    # HTTP
+
+    def expire_sessions(self):
+        # following requests get 401 until client logs in again
+        self.sessions = set()
+
+    @web.middleware
+    async def __latency(self, request, handler):
+        await asyncio.sleep(self.http_latency)
+        return await handler(request)
+
+    def __check_session(self, request):
+        self.http_requests += 1
+        if request.cookies.get("PHPSESSID") not in self.sessions:
+            raise web.HTTPUnauthorized()
+
+    async def __login(self, request):
+        self.http_requests += 1
+        return web.Response(
+            content_type="text/html",
+            text=f'<html><body><form><input type="hidden" name="_csrf_token" value="{self.csrf_token}"></form></body></html>',
+        )
+
+    async def __login_check(self, request):
+        self.http_requests += 1
+        data = await request.post()
+        if data.get("_csrf_token") != self.csrf_token:
+            raise web.HTTPForbidden()
+        session = uuid.uuid4().hex
+        self.sessions.add(session)
+        response = web.Response(
+            content_type="text/html",
+            text='<html><body><div id="id-loading-screen-blackout"></div></body></html>',
+        )
+        response.set_cookie("PHPSESSID", session)
+        return response
+
+    async def __notifications(self, request):
+        self.__check_session(request)
+        return web.Response(content_type="text/html", text="<html><body></body></html>")
+
+    async def __installations(self, request):
+        self.__check_session(request)
+        installations = []
+        for device in self.devices.values():
+            installations.append({
+                "value": device["id"],
+                "label": device["serial"],
+                "place": "Mock place",
+                "address": "Mock address",
+                "type": device["type"],
+                "product": device["type"],
+            })
+        return web.json_response({"installations": installations})
+
+    async def __configuration(self, request):
+        self.__check_session(request)
+        return web.json_response({"user": {}, "installations": len(self.devices)})
+
+    async def __widgetgrid_list(self, request):
+        self.__check_session(request)
+        return web.json_response({"selected": 1, "list": [{"id": 1}]})
+
+    async def __widgetgrid(self, request):
+        self.__check_session(request)
+        widgets = []
+        for device in self.devices.values():
+            widgets.append({
+                "id": device["id"],
+                "template": "v3.timetable",
+                "data": {"installation": device["id"]},
+            })
+        return web.json_response({"grid": json.dumps({"widgets": widgets})})
+
+    async def __installation_status_all(self, request):
+        self.__check_session(request)
+        data = await request.json()
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        result = dict()
+        for id in data["installations"]:
+            device = self.devices[int(id)]
+            params = {name: {"v": value, "ut": timestamp} for name, value in device["parameters"].items()}
+            result[str(id)] = {
+                "installation": {"country": "Croatia", "countryCode": "HR"},
+                "params": params,
+            }
+        return web.json_response(result)
+
+    async def __parameter_list(self, request):
+        self.__check_session(request)
+        device = self.get_device_by_serial(request.match_info["serial"])
+        # dbindex is numeric like in real responses
+        names = [name for name in device["parameters"] if name.startswith("B_T")]
+        temperatures = [{"dbindex": index, "naslov": name, "name": name} for index, name in enumerate(names)]
+        return web.json_response({
+            "city": "Zagreb",
+            "parameters": [
+                {"group": "Temperatures", "list": temperatures},
+                {"group": "Info", "list": [{"installation_status": "B_STATE"}]},
+                {"group": "Weather forecast", "list": []},
+                {"group": "Heating circuits", "list": [{"naslov": "PWR 1"}]},
+            ],
+        })
+
+    async def __control_multiple(self, request):
+        self.__check_session(request)
+        self.control_requests += 1
+        data = await request.json()
+        for id, commands in data["messages"].items():
+            device = self.devices[int(id)]
+            for name, value in commands.items():
+                if name == "RSTAT":
+                    asyncio.get_running_loop().create_task(self.publish_all(device))
+                elif name.startswith("PWR "):
+                    device["parameters"][name] = str(value)
+                    asyncio.get_running_loop().create_task(self.publish_frame(device, [name]))
+        return web.json_response({"status": "success"})
+
+    async def __control(self, request):
+        self.__check_session(request)
+        self.control_requests += 1
+        device = self.devices[int(request.match_info["id"])]
+        data = await request.json()
+        if data.get("cmd-name") == "CMD":
+            device["parameters"]["B_STATE"] = "ON" if data["cmd-value"] else "OFF"
+        return web.json_response({"status": "success"})
+
+    async def __control_advanced(self, request):
+        self.__check_session(request)
+        self.control_requests += 1
+        device = self.devices[int(request.match_info["id"])]
+        data = await request.json()
+        values = dict()
+        for name in data["parameters"].keys():
+            values[name] = device["parameters"].get(name, "0")
+        return web.json_response({"status": "success", "data": values})
+
+    # STOMP
+
+    async def __on_ws_message(self, message):
+        data = message.data
+        if not isinstance(data, str) or data.strip() == "":
+            return
+        frame = stomper.unpack_frame(data)
+        client = message.author
+        if frame["cmd"] == "CONNECT":
+            await client.send(f"CONNECTED\nversion:1.1\nheart-beat:{self.heart_beat[0]},{self.heart_beat[1]}\n\n\x00")
+        elif frame["cmd"] == "SUBSCRIBE":
+            headers = frame["headers"]
+            self.subscriptions.setdefault(client, dict())[headers["destination"]] = headers["id"]
+        elif frame["cmd"] == "UNSUBSCRIBE":
+            subscriptions = self.subscriptions.get(client, dict())
+            for destination, id in list(subscriptions.items()):
+                if id == frame["headers"].get("id"):
+                    del subscriptions[destination]
+        elif frame["cmd"] == "DISCONNECT":
+            await client.close()
+
+    async def __on_ws_disconnect(self, client, code, reason):
+        self.subscriptions.pop(client, None)
+
+    async def drop_clients(self, code = 1011, reason = "mock drop"):
+        # closes all websocket connections, used to exercise client reconnect
+        for client in list(self.subscriptions.keys()):
+            try:
+                await client.close(code=code, reason=reason)
+            except Exception as e:
+                self.logger.warning(f"WebBoilerMockServer - close failed {e}")
+            self.subscriptions.pop(client, None)
+
+    def create_frame(self, destination, subscription, body):
+        self.message_index += 1
+        return (
+            "MESSAGE\n"
+            f"subscription:{subscription}\n"
+            f"destination:{destination}\n"
+            f"message-id:T_{subscription}@@mock@@{self.message_index}\n"
+            "redelivered:false\n"
+            "content-type:application/json\n"
+            f"content-length:{len(body.encode())}\n"
+            "\n"
+            f"{body}\x00"
+        )
+
+    async def publish_frame(self, device, names = None):
+        if names is None:
+            names = random.sample(list(device["parameters"].keys()), min(self.parameters_per_frame, len(device["parameters"])))
+            for name in names:
+                device["parameters"][name] = str(random.randint(0, 100))
+        body = json.dumps({name: device["parameters"][name] for name in names})
+        destination = WEB_BOILER_STOMP_DEVICE_TOPIC + device["type"] + "." + device["serial"]
+        for client, subscriptions in list(self.subscriptions.items()):
+            if destination in subscriptions:
+                try:
+                    await client.send(self.create_frame(destination, subscriptions[destination], body))
+                    self.frames_sent += 1
+                except Exception as e:
+                    self.logger.warning(f"WebBoilerMockServer - send failed {e}")
+
+    async def publish_all(self, device):
+        await self.publish_frame(device, list(device["parameters"].keys()))
+
+    async def __send_heart_beats(self):
+        while True:
+            await asyncio.sleep(self.heart_beat[0] / 1000)
+            for client in list(self.subscriptions.keys()):
+                try:
+                    await client.send("\n")
+                except Exception as e:
+                    self.logger.warning(f"WebBoilerMockServer - heart-beat failed {e}")
+
+    async def __publish(self):
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.rate
+        devices = list(self.devices.values())
+        index = 0
+        next_time = loop.time()
+        while True:
+            await self.publish_frame(devices[index % len(devices)])
+            index += 1
+            next_time += interval
+            delay = next_time - loop.time()
+            # when behind schedule keep publishing, but still let other tasks run
+            await asyncio.sleep(delay if delay > 0 else 0)
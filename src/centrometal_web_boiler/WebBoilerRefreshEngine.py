@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import logging
+import asyncio
+import time
+
+
+class TokenBucket:
+    # rate tokens per second, up to capacity tokens can be taken at once, rate <= 0 disables limiting
+    def __init__(self, rate, capacity = None):
+        self.rate = rate
+        self.capacity = max(1, rate) if capacity is None else capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.waited = 0
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+                self.waited += delay
+                await asyncio.sleep(delay)
+
+
+class WebBoilerRefreshEngine:
+    # Refreshes devices with REFRESH followed by RSTAT ALL commands. Devices are packed into
+    # one /api/inst/control/multiple request (pack_size ids per messages payload), up to
+    # concurrency packs are in flight and every request takes a token from rate limiter.
+    def __init__(self, http_client, concurrency = 4, rate = 2, burst = None, pack_size = 10):
+        self.logger = logging.getLogger(__name__)
+        self.http_client = http_client
+        self.concurrency = concurrency
+        self.pack_size = pack_size
+        self.bucket = TokenBucket(rate, burst)
+        # results of the last finished refresh, reported by get_stats
+        self.results = dict()
+        self.requests = 0
+        self.failures = 0
+
+    def set_limits(self, concurrency = None, rate = None, burst = None, pack_size = None):
+        if concurrency is not None:
+            self.concurrency = concurrency
+        if pack_size is not None:
+            self.pack_size = pack_size
+        if rate is not None or burst is not None:
+            self.bucket = TokenBucket(self.bucket.rate if rate is None else rate, burst)
+
+    def get_stats(self):
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "rate_limited": self.bucket.waited,
+            "succeeded": sum(1 for result in self.results.values() if result is True),
+            "failed": sum(1 for result in self.results.values() if result is not True),
+        }
+
+    async def __send(self, command, ids):
+        await self.bucket.acquire()
+        self.requests += 1
+        response = await command(ids)
+        if response.get("status") != "success":
+            raise Exception(f"WebBoilerRefreshEngine - unexpected response {response}")
+
+    async def __refresh_pack(self, semaphore, ids, delay, on_device_refreshed, results):
+        async with semaphore:
+            try:
+                await self.__send(self.http_client.refresh_devices, ids)
+                await asyncio.sleep(delay)
+                await self.__send(self.http_client.rstat_all_devices, ids)
+                result = True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                self.logger.error(f"WebBoilerRefreshEngine - refresh of {ids} failed {e} ({self.http_client.username})")
+                result = e
+        for id in ids:
+            results[id] = result
+            if on_device_refreshed is not None:
+                await on_device_refreshed(id, result is True, None if result is True else result)
+
+    async def refresh(self, ids, delay = 2, on_device_refreshed = None):
+        # returns {id: True or exception}, on_device_refreshed(id, success, error) is called as packs finish,
+        # every call has its own results so overlapping refreshes do not overwrite each other
+        results = dict()
+        ids = list(ids)
+        pack_size = max(1, self.pack_size)
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+        await asyncio.gather(*[
+            self.__refresh_pack(semaphore, ids[i:i + pack_size], delay, on_device_refreshed, results)
+            for i in range(0, len(ids), pack_size)
+        ])
+        self.results = results
+        return results
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import time
+import logging
+from http.cookies import SimpleCookie
+from yarl import URL
+from centrometal_web_boiler.WebBoilerAccountFiles import WebBoilerAccountFiles
+
+SESSION_VERSION = 1
+
+
+class WebBoilerSessionStore(WebBoilerAccountFiles):
+    # Keeps authenticated cookies and csrf token of every account in its own file, so that
+    # after restart the session can be validated with one request instead of logging in again.
+    # Files contain session secrets and are created readable only by the owner.
+    def __init__(self, path, ttl = 7 * 24 * 3600):
+        super().__init__(path, ".session.json", 0o600)
+        self.logger = logging.getLogger(__name__)
+        self.ttl = ttl
+
+    def load(self, username, webroot):
+        session = self.read(username)
+        if session is None:
+            return None
+        if session.get("version") != SESSION_VERSION or session.get("username") != username or session.get("webroot") != webroot:
+            return None
+        if self.ttl is not None and time.time() - session.get("created", 0) > self.ttl:
+            self.logger.info(f"WebBoilerSessionStore - session expired ({username})")
+            return None
+        return session
+
+    def save(self, username, webroot, cookie_jar, csrf_token):
+        cookies = []
+        for morsel in cookie_jar:
+            cookies.append({
+                "name": morsel.key,
+                "value": morsel.value,
+                "domain": morsel["domain"],
+                "path": morsel["path"],
+                "secure": bool(morsel["secure"]),
+                "httponly": bool(morsel["httponly"]),
+            })
+        session = {
+            "version": SESSION_VERSION,
+            "username": username,
+            "webroot": webroot,
+            "created": time.time(),
+            "csrf_token": csrf_token,
+            "cookies": cookies,
+        }
+        self.write(username, session)
+
+    @staticmethod
+    def restore_cookies(session, cookie_jar):
+        response_url = URL(session["webroot"])
+        for cookie in session["cookies"]:
+            simple_cookie = SimpleCookie()
+            simple_cookie[cookie["name"]] = cookie["value"]
+            morsel = simple_cookie[cookie["name"]]
+            if cookie["domain"]:
+                morsel["domain"] = cookie["domain"]
+            morsel["path"] = cookie["path"] or "/"
+            morsel["secure"] = cookie["secure"]
+            morsel["httponly"] = cookie["httponly"]
+            cookie_jar.update_cookies(simple_cookie, response_url)
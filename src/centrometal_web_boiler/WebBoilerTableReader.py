@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Tihomir Heidelberg
+"""
+
+import logging
+import asyncio
+from typing import NamedTuple
+
+
+class WebBoilerTable(NamedTuple):
+    id: int
+    start_index: int
+    size: int
+    value: object
+    rows: dict
+    errors: dict
+
+    @property
+    def complete(self) -> bool:
+        return len(self.errors) == 0 and len(self.rows) == self.size
+
+    def as_list(self) -> list:
+        return [self.rows.get(index) for index in range(1, self.size + 1)]
+
+
+class WebBoilerTableError(Exception):
+    pass
+
+
+class WebBoilerTableReader:
+    # Reads tables (PRD start_index followed by size rows) through /api/inst/control/advanced.
+    # Values are expected in the reply, in "data" or at top level. First reply is checked before
+    # other rows are requested, when it carries no requested value every read raises
+    # WebBoilerTableError. Rows missing from later replies are reported as row errors.
+    # One row is asked per request like get_table_data, rows_per_request > 1 sends several rows
+    # in one parameters payload and is meant only for endpoints answering all of them.
+    # Requests of all tables share one concurrency limit, failed requests are retried with backoff.
+    def __init__(self, http_client, concurrency = 4, retries = 2, retry_delay = 0.5, rows_per_request = 1):
+        self.logger = logging.getLogger(__name__)
+        self.http_client = http_client
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.rows_per_request = rows_per_request
+        self.semaphore = None
+        # None until first reply shows whether endpoint returns values
+        self.reply_has_values = None
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+
+    def get_stats(self):
+        return {
+            "requests": self.requests,
+            "retried": self.retried,
+            "failures": self.failures,
+        }
+
+    @staticmethod
+    def get_response_values(response):
+        if "data" in response and isinstance(response["data"], dict):
+            return response["data"]
+        return {key: value for key, value in response.items() if key != "status"}
+
+    async def __request(self, id, start_index, sub_indexes):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(max(1, self.concurrency))
+        attempt = 0
+        while True:
+            try:
+                async with self.semaphore:
+                    self.requests += 1
+                    if len(sub_indexes) == 1:
+                        response = await self.http_client.get_table_data(id, start_index, sub_indexes[0])
+                    else:
+                        response = await self.http_client.get_table_data_rows(id, start_index, sub_indexes)
+                if response.get("status", "success") != "success":
+                    raise Exception(f"WebBoilerTableReader - unexpected response {response}")
+                return WebBoilerTableReader.get_response_values(response)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt >= self.retries:
+                    self.failures += 1
+                    raise
+                self.retried += 1
+                self.logger.warning(f"WebBoilerTableReader - table {start_index} of {id} failed {e}, retrying ({self.http_client.username})")
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+                attempt += 1
+
+    async def __read_rows(self, id, start_index, sub_indexes, table):
+        value, rows, errors = table
+        try:
+            values = await self.__request(id, start_index, sub_indexes)
+        except Exception as e:
+            for sub_index in sub_indexes:
+                errors[sub_index] = e
+            return
+        names = ["PRD " + str(start_index + sub_index) for sub_index in sub_indexes]
+        if self.reply_has_values is None:
+            self.reply_has_values = any(name in values for name in ["PRD " + str(start_index)] + names)
+        if not self.reply_has_values:
+            # status only reply, values are not delivered by this endpoint
+            raise WebBoilerTableError(f"WebBoilerTableReader - reply for table {start_index} of {id} has no values")
+        name = "PRD " + str(start_index)
+        if name in values:
+            value[0] = values[name]
+        for sub_index, name in zip(sub_indexes, names):
+            if name in values:
+                rows[sub_index] = values[name]
+            else:
+                errors[sub_index] = WebBoilerTableError(f"WebBoilerTableReader - no value for row {sub_index}")
+
+    async def read_table(self, id, start_index, size) -> WebBoilerTable:
+        if size <= 0:
+            return WebBoilerTable(id, start_index, 0, None, dict(), dict())
+        if self.reply_has_values is False:
+            raise WebBoilerTableError(f"WebBoilerTableReader - replies have no values ({self.http_client.username})")
+        rows_per_request = max(1, self.rows_per_request)
+        sub_indexes = list(range(1, size + 1))
+        chunks = [sub_indexes[i:i + rows_per_request] for i in range(0, size, rows_per_request)]
+        table = ([None], dict(), dict())
+        if self.reply_has_values is None:
+            # reply shape is checked with one request before the rest of table is requested
+            await self.__read_rows(id, start_index, chunks.pop(0), table)
+        await asyncio.gather(*[self.__read_rows(id, start_index, chunk, table) for chunk in chunks])
+        value, rows, errors = table
+        return WebBoilerTable(
+            id, start_index, size, value[0],
+            {sub_index: rows[sub_index] for sub_index in sorted(rows.keys())},
+            errors,
+        )
+
+    async def read_tables(self, tables) -> list:
+        # tables is list of (id, start_index, size), results are in the same order
+        return await asyncio.gather(*[self.read_table(id, start_index, size) for id, start_index, size in tables])
@@ -3,10 +3,17 @@
 @author: Tihomir Heidelberg
 """
 
+import asyncio
+import json
 import logging
+import random
+import time
 import stomper
 import ssl
-from centrometal_web_boiler.ws import ClientSocket
+from centrometal_web_boiler.ws import ClientSocket, MessageDispatcher
+from centrometal_web_boiler.StompFrameParser import StompFrameParser
+from centrometal_web_boiler.StompHeartbeat import StompHeartbeat
+from centrometal_web_boiler.JsonStreamParser import json_loads
 
 from centrometal_web_boiler.const import (
     WEB_BOILER_STOMP_LOGIN_USERNAME, 
@@ -17,56 +24,281 @@ from centrometal_web_boiler.const import (
 
 class WebBoilerWsClient:
 
-    def __init__(self, connected_callback, disconnected_callback, close_callback, data_callback):
+    def __init__(self, connected_callback, disconnected_callback, close_callback, data_callback, stomp_url = None, raw_messages = True, dispatcher = None):
         self.logger = logging.getLogger(__name__)
+        self.stomp_url = WEB_BOILER_STOMP_URL if stomp_url is None else stomp_url
         self.connected_callback = connected_callback
         self.disconnected_callback = disconnected_callback
         self.close_callback = close_callback
         self.data_callback = data_callback
-        self.client = ClientSocket()
+        self.raw_messages = raw_messages
+        if dispatcher is None:
+            dispatcher = MessageDispatcher(key=WebBoilerWsClient.get_frame_destination, inline=WebBoilerWsClient.is_heartbeat_frame)
+        if dispatcher.merge is None:
+            # message bodies are partial updates, coalescing must merge them instead of replacing
+            dispatcher.merge = WebBoilerWsClient.merge_frames
+        self.dispatcher = dispatcher
+        self.client = ClientSocket(raw=raw_messages, dispatcher=dispatcher)
+        self.parser = StompFrameParser()
         self.username = ""
         self.subscription_index = 0
+        self.ssl_context = None
+        self.heartbeat = StompHeartbeat(self.client, self.on_heartbeat_timeout)
+        self.recorder = None
+        self.metrics = None
+        self.main_task = None
+        self.close_event = asyncio.Event()
+        self.reconnect = False
+        self.reconnect_min_delay = 1
+        self.reconnect_max_delay = 60
+        self.reconnect_factor = 2
+        self.reconnect_jitter = 0.5
+        self.reconnect_attempt = 0
+        self.reconnects = 0
+        self.reconnect_failures = 0
+        self.connected_count = 0
+        self.disconnected_at = None
+        self.last_recovery_time = None
 
         @self.client.on('connect')        
         async def on_connect():
             self.logger.info(f"WebBoilerWsClient::on_connect ({self.username})")
-            await self.client.send(stomper.connect(WEB_BOILER_STOMP_LOGIN_USERNAME, WEB_BOILER_STOMP_LOGIN_PASSCODE, "/", (90000, 60000)))
+            await self.client.send(stomper.connect(WEB_BOILER_STOMP_LOGIN_USERNAME, WEB_BOILER_STOMP_LOGIN_PASSCODE, "/", self.heartbeat.client_heart_beat))
 
         @self.client.on('message')
         async def on_message(message):
-            data = message.data
-            # Send new line to any frame (keep alive frame)
-            await self.client.send("\n")
-            if data == "\n": # We received keep alive frame, ignore it
+            data = message if self.raw_messages else message.data
+            if self.metrics is not None:
+                self.metrics.ws_messages.inc(1, (self.username,))
+                if isinstance(data, (str, bytes)):
+                    self.metrics.ws_bytes.inc(len(data), (self.username,))
+            if data == "\n" or data == b"\n":
+                self.heartbeat.on_heart_beat_received()
                 return
-            frame = stomper.unpack_frame(data)
-            if frame["cmd"] == "ERROR":
-                await self.error_callback(self.client, frame)
-                return
-            if frame["cmd"] == "CONNECTED":
-                self.logger.info(f"WebBoilerWsClient::on_message connected ({self.username})")
-                await self.connected_callback(self.client, frame)
-                return
-            self.logger.debug(f"WebBoilerWsClient::on_message {frame} ({self.username})")
-            await self.data_callback(self.client, frame)
+            if self.recorder is not None:
+                # arrival time, message may have waited in dispatch queue
+                received_at = MessageDispatcher.received_at.get()
+                timestamp = None if received_at is None else time.time() - (time.monotonic() - received_at)
+                self.recorder.record(data, timestamp)
+            # keep alive frames are skipped by parser, one message can carry several or partial frames
+            for frame in self.parser.feed(data):
+                await self.on_frame(frame)
 
         @self.client.on('disconnect')
         async def on_disconnect(code, reason):
             self.logger.error(f"WebBoilerWsClient::on_disconnect - {code} - {reason} ({self.username})")
+            self.heartbeat.stop()
             await self.disconnected_callback(self.client, code, reason)
 
         @self.client.on("close")
         async def on_close(code, reason):
             self.logger.info(f"WebBoilerWsClient::on_close close_status_code:{code} close_msg:{reason} ({self.username})")
+            self.heartbeat.stop()
             await self.disconnected_callback(self.client, code, reason)
 
+    async def on_frame(self, frame):
+        if frame["cmd"] == "ERROR":
+            await self.close_callback(self.client, frame)
+            return
+        if frame["cmd"] == "CONNECTED":
+            self.logger.info(f"WebBoilerWsClient::on_message connected ({self.username})")
+            self.connected_count += 1
+            self.reconnect_attempt = 0
+            if self.disconnected_at is not None:
+                self.last_recovery_time = time.monotonic() - self.disconnected_at
+                self.disconnected_at = None
+            # heart-beats are sent only when connection is idle, not as reply to every frame
+            self.heartbeat.username = self.username
+            self.heartbeat.start(frame["headers"].get("heart-beat"))
+            await self.connected_callback(self.client, frame)
+            return
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug(f"WebBoilerWsClient::on_message {frame} ({self.username})")
+        if self.metrics is None:
+            await self.data_callback(self.client, frame)
+            return
+        start = time.perf_counter()
+        await self.data_callback(self.client, frame)
+        self.metrics.frame_duration.observe(time.perf_counter() - start, (self.username,))
+
+    @staticmethod
+    def get_frame_destination(message):
+        # cheap destination header lookup used to keep frames of one device in order
+        data = message if isinstance(message, (str, bytes)) else message.data
+        if isinstance(data, bytes):
+            start = data.find(b"\ndestination:")
+            end = data.find(b"\n", start + 1)
+        elif isinstance(data, str):
+            start = data.find("\ndestination:")
+            end = data.find("\n", start + 1)
+        else:
+            return None
+        if start < 0 or end < 0:
+            return None
+        return data[start + 13:end]
+
+    @staticmethod
+    def split_message_frame(data):
+        # (headers without content-length, body object) of single MESSAGE frame with JSON object body
+        binary = isinstance(data, bytes)
+        nl, nul, cr = (b"\n", b"\x00", b"\r") if binary else ("\n", "\x00", "\r")
+        if not data.startswith(b"MESSAGE\n" if binary else "MESSAGE\n"):
+            return None
+        headers_end = data.find(nl + nl)
+        if headers_end < 0 or cr in data[:headers_end]:
+            return None
+        end = data.find(nul, headers_end + 2)
+        if end < 0 or data[end + 1:].strip(nl) != data[:0]:
+            return None
+        try:
+            body = json_loads(data[headers_end + 2:end])
+        except ValueError:
+            return None
+        if not isinstance(body, dict):
+            return None
+        content_length = b"content-length:" if binary else "content-length:"
+        headers = [line for line in data[:headers_end].split(nl) if not line.startswith(content_length)]
+        return (nl.join(headers), body)
+
+    @staticmethod
+    def merge_frames(queued, message):
+        # newer frame with parameters of queued frame it replaces, None when frames cannot be merged
+        if not isinstance(queued, (str, bytes)) or type(queued) != type(message):
+            return None
+        queued_parts = WebBoilerWsClient.split_message_frame(queued)
+        parts = WebBoilerWsClient.split_message_frame(message)
+        if queued_parts is None or parts is None:
+            return None
+        body = dict(queued_parts[1])
+        body.update(parts[1])
+        body = json.dumps(body, separators=(",", ":"))
+        if isinstance(message, bytes):
+            return parts[0] + b"\n\n" + body.encode() + b"\x00"
+        return parts[0] + "\n\n" + body + "\x00"
+
+    @staticmethod
+    def is_heartbeat_frame(message):
+        data = message if isinstance(message, (str, bytes)) else message.data
+        return data == "\n" or data == b"\n"
+
+    def set_metrics(self, metrics):
+        self.metrics = metrics
+        if metrics is None:
+            self.dispatcher.observe_latency = None
+        else:
+            self.dispatcher.observe_latency = lambda latency: metrics.dispatch_latency.observe(latency, (self.username,))
+
+    def get_dispatch_stats(self):
+        return self.dispatcher.stats()
+
+    @property
+    def reconnected(self):
+        return self.connected_count > 1
+
+    def set_reconnect(self, reconnect, min_delay = 1, max_delay = 60, factor = 2, jitter = 0.5):
+        # delay before n-th attempt is min(max_delay, min_delay * factor ** n) reduced by up to jitter part,
+        # attempt counter is reset when server confirms connection
+        self.reconnect = reconnect
+        self.reconnect_min_delay = min_delay
+        self.reconnect_max_delay = max_delay
+        self.reconnect_factor = factor
+        self.reconnect_jitter = jitter
+
+    def get_reconnect_delay(self):
+        delay = min(self.reconnect_max_delay, self.reconnect_min_delay * self.reconnect_factor ** self.reconnect_attempt)
+        return delay * (1 - self.reconnect_jitter * random.random())
+
+    def get_reconnect_stats(self):
+        return {
+            "reconnect": self.reconnect,
+            "connected": self.connected_count,
+            "reconnects": self.reconnects,
+            "failures": self.reconnect_failures,
+            "attempt": self.reconnect_attempt,
+            "last_recovery_time": self.last_recovery_time,
+        }
+
+    def get_heartbeat_stats(self):
+        return self.heartbeat.stats()
+
+    async def on_heartbeat_timeout(self):
+        # server stopped sending, close connection so disconnect/close callbacks handle it
+        self.logger.error(f"WebBoilerWsClient::on_heartbeat_timeout ({self.username})")
+        try:
+            await asyncio.wait_for(self.client.close(code=4000, reason="heart-beat timeout"), 10)
+        except Exception as e:
+            self.logger.warning(f"WebBoilerWsClient::on_heartbeat_timeout close failed {e} ({self.username})")
+
     async def start(self, username):
+        # previous supervisor must be finished, it shares ClientSocket with the new one
+        await self.__stop_supervisor()
         self.username = username
+        self.parser.reset()
         self.logger.info(f"WebBoilerWsClient connecting... ({self.username})")
         # _ClientSocket__main is hack to call private method __main in ClientSocket
-        self.client.loop.create_task(self.client._ClientSocket__main(WEB_BOILER_STOMP_URL, ssl=ssl.create_default_context()))
+        # use running loop, client loop is bound at construction time and may differ when clients are pooled
+        self.client.loop = asyncio.get_running_loop()
+        kwargs = dict()
+        if self.stomp_url.startswith("wss:"):
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            kwargs["ssl"] = self.ssl_context
+        # every run has its own close event, so old run never sees event cleared by new one
+        self.close_event = asyncio.Event()
+        self.main_task = self.client.loop.create_task(self.__supervise(self.close_event, **kwargs))
+
+    async def __stop_supervisor(self):
+        task = self.main_task
+        self.main_task = None
+        if task is None or task.done():
+            return
+        self.close_event.set()
+        connection = self.client.connection
+        if connection is not None and not connection.closed:
+            try:
+                await asyncio.wait_for(connection.close(), 10)
+            except Exception as e:
+                self.logger.warning(f"WebBoilerWsClient - closing previous connection failed {e} ({self.username})")
+        try:
+            await asyncio.wait_for(task, 10)
+        except asyncio.TimeoutError:
+            self.logger.warning(f"WebBoilerWsClient - previous connection did not stop, cancelled ({self.username})")
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise
+        except Exception as e:
+            self.logger.warning(f"WebBoilerWsClient - previous connection failed {e} ({self.username})")
+
+    async def __supervise(self, close_event, **kwargs):
+        # runs one ClientSocket connection after another until closed, with backoff between attempts
+        while True:
+            try:
+                await self.client._ClientSocket__main(self.stomp_url, **kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.reconnect_failures += 1
+                self.logger.error(f"WebBoilerWsClient connection failed {e} ({self.username})")
+            self.heartbeat.stop()
+            if not self.reconnect or close_event.is_set():
+                return
+            if self.disconnected_at is None:
+                self.disconnected_at = time.monotonic()
+            delay = self.get_reconnect_delay()
+            self.reconnect_attempt += 1
+            self.logger.info(f"WebBoilerWsClient reconnecting in {delay:.1f}s, attempt {self.reconnect_attempt} ({self.username})")
+            try:
+                await asyncio.wait_for(close_event.wait(), delay)
+                return
+            except asyncio.TimeoutError:
+                pass
+            self.reconnects += 1
+            self.parser.reset()
+            self.subscription_index = 0
 
     async def close(self):
+        self.close_event.set()
+        self.heartbeat.stop()
         if self.client.connection:
             await self.client.close()
 
@@ -1,6 +1,19 @@
 from .const import *
+from .StompFrameParser import StompFrameParser
+from .StompHeartbeat import StompHeartbeat
 from .WebBoilerWsClient import WebBoilerWsClient
-from .HttpClient import HttpClient
+from .HttpClient import HttpClient, HttpClientError, HttpSessionExpiredError, HttpCircuitOpenError
 from .HttpHelper import HttpHelper
 from .WebBoilerDeviceCollection import WebBoilerDeviceCollection
-from .WebBoilerClient import WebBoilerClient 
+from .WebBoilerInterestSet import WebBoilerInterestSet
+from .WebBoilerChangeFilter import WebBoilerChangeFilter
+from .WebBoilerConfigurationCache import WebBoilerConfigurationCache
+from .WebBoilerSessionStore import WebBoilerSessionStore
+from .WebBoilerHistory import WebBoilerHistory, WebBoilerHistorySeries, WebBoilerHistoryBucket
+from .WebBoilerFrameRecorder import WebBoilerFrameRecorder, WebBoilerFrameReplay, read_frame_records
+from .WebBoilerRefreshEngine import WebBoilerRefreshEngine, TokenBucket
+from .WebBoilerCommandQueue import WebBoilerCommandQueue
+from .WebBoilerTableReader import WebBoilerTableReader, WebBoilerTable, WebBoilerTableError
+from .WebBoilerMetrics import WebBoilerMetrics
+from .WebBoilerClient import WebBoilerClient
+from .WebBoilerClientPool import WebBoilerClientPool
@@ -5,10 +5,11 @@
 
 import os
 
-WEB_BOILER_WEBROOT = 'https://www.web-boiler.com'
+# Base URLs can be overridden from environment, e.g. to point client at WebBoilerMockServer
+WEB_BOILER_WEBROOT = os.environ.get("WEB_BOILER_WEBROOT", 'https://www.web-boiler.com')
 
 WEB_BOILER_STOMP_LOGIN_USERNAME = "appuser"
 WEB_BOILER_STOMP_LOGIN_PASSCODE = "appuser"
-WEB_BOILER_STOMP_URL = 'wss://web-boiler.com:15671/ws'
+WEB_BOILER_STOMP_URL = os.environ.get("WEB_BOILER_STOMP_URL", 'wss://web-boiler.com:15671/ws')
 WEB_BOILER_STOMP_DEVICE_TOPIC = "/topic/cm.inst."
 WEB_BOILER_STOMP_NOTIFICATION_TOPIC = "/queue/notification"
@@ -6,6 +6,7 @@ from .models import Message, Object
 from .wsprotocols import WSSProtocol, WSCProtocol
 from .exceptions import ParameterConflict, EventNotFound
 from .collector import EventCollector
+from .dispatcher import MessageDispatcher
 
 class VersionInfo(NamedTuple):
     major: int
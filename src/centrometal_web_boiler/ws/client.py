@@ -1,5 +1,5 @@
 from datetime import datetime
-import websockets, typing, asyncio, json
+import websockets, typing, asyncio, json, time
 from json.decoder import JSONDecodeError
 from websockets import ConnectionClosedError
 
@@ -7,17 +7,30 @@ from .base import BaseSocket
 from .models import Message, Object
 from .wsprotocols import WSCProtocol
 from .collector import EventCollector
+from .dispatcher import MessageDispatcher
 
 
 class ClientSocket(BaseSocket):
-    def __init__(self):
+    def __init__(self, raw: bool = False, dispatcher: typing.Optional[MessageDispatcher] = None):
         super().__init__()
+        # raw mode passes received str/bytes to listeners as is, without json decoding and Message wrapping
+        self.raw = raw
+        # with dispatcher, listeners run in dispatcher workers instead of a TaskGroup per message
+        self.dispatcher = dispatcher
         self.listeners["message"].append(self.on_message)
         self.listeners["connect"].append(self.on_connect)
         self.listeners["disconnect"].append(self.on_disconnect)
         self.listeners.close.append(self.on_close)
         self.connection = None
         self.disconnection = None
+        # monotonic time of last received and sent message, used for keepalive scheduling
+        self.last_received = 0
+        self.last_sent = 0
+
+    @property
+    def reading_paused(self) -> bool:
+        # reader waits for full dispatcher queue, silence on socket is not caused by server
+        return self.dispatcher is not None and self.dispatcher.blocked > 0
 
     def connect(self, uri: str, **kwargs):
         kwargs.pop("create_protocol", None)
@@ -27,16 +40,34 @@ class ClientSocket(BaseSocket):
     async def on_message(self, message):
         pass
 
+    async def __dispatch(self, message_cls):
+        for coro in self.listeners["message"]:
+            await coro(message_cls)
+        for futures in list(self.listeners.message_collector):
+            await self.__collector_verifier(futures, "message", message_cls)
+
     async def __message_consumer(self):
+        if self.dispatcher is not None:
+            self.dispatcher.start(self.__dispatch)
         try:
             async for message in self.connection:
-                try:
-                    data = json.loads(message)
-                except JSONDecodeError:
-                    data = message
-                message_cls: Message = Message(
-                    data=data, websocket=self.connection, created_at=datetime.utcnow()
-                )
+                self.last_received = time.monotonic()
+                if self.raw:
+                    message_cls = message
+                else:
+                    try:
+                        data = json.loads(message)
+                    except JSONDecodeError:
+                        data = message
+                    message_cls: Message = Message(
+                        data=data, websocket=self.connection, created_at=datetime.utcnow()
+                    )
+                if self.dispatcher is not None:
+                    await self.dispatcher.put(message_cls)
+                    if self.dispatcher.policy == MessageDispatcher.BLOCK:
+                        # put may have waited, server gets full interval once reading resumes
+                        self.last_received = time.monotonic()
+                    continue
                 async with asyncio.TaskGroup() as tg:
                     for coro in self.listeners["message"]:
                         tg.create_task(coro(message_cls))
@@ -63,6 +94,10 @@ class ClientSocket(BaseSocket):
                 )
             )
             return e
+        finally:
+            if self.dispatcher is not None:
+                # messages received before connection was closed are still delivered
+                await self.dispatcher.stop(drain=True)
 
     async def __on_connect(self):
         async with asyncio.TaskGroup() as tg:
@@ -98,6 +133,7 @@ class ClientSocket(BaseSocket):
 
     async def __main(self, uri, **kwargs):
         self.connection = await websockets.connect(uri, **kwargs)
+        self.last_received = self.last_sent = time.monotonic()
         async with asyncio.TaskGroup() as tg:
             tg.create_task(self.__on_connect())
         done = await asyncio.wait_for(self.__message_consumer(), timeout=None)
@@ -130,6 +166,13 @@ class ClientSocket(BaseSocket):
 
     async def send(self, content: typing.Any = None, *, data: dict = None):
         await self.connection.send(content)
+        self.last_sent = time.monotonic()
+
+    async def ping(self) -> float:
+        start = time.monotonic()
+        pong_waiter = await self.connection.ping()
+        await pong_waiter
+        return time.monotonic() - start
 
     async def close(self, code: int = 1000, reason: str = ""):
         await self.connection.close(code=code, reason=reason)
@@ -0,0 +1,184 @@
+import typing, asyncio, logging, time, contextvars
+from collections import deque
+
+
+class MessageDispatcher:
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    COALESCE = "coalesce"
+    policies = [BLOCK, DROP_OLDEST, COALESCE]
+    # monotonic time put was called with the message being handled, readable inside handler
+    received_at = contextvars.ContextVar("received_at", default=None)
+
+    def __init__(self, maxsize: int = 1000, workers: int = 1, policy: str = BLOCK,
+                       key: typing.Optional[typing.Callable] = None,
+                       inline: typing.Optional[typing.Callable] = None,
+                       merge: typing.Optional[typing.Callable] = None):
+        """
+            Bounded message queue processed by a fixed number of worker coroutines.
+
+            Messages with the same key (e.g. STOMP destination) always go to the same worker,
+            so their order is preserved. When a worker queue is full the policy decides:
+            block the reader, drop the oldest queued message, or coalesce with the newest queued
+            message with the same key. Coalesce replaces that message, which is lossy when
+            messages are partial updates, and falls back to drop oldest. With merge(queued, message)
+            the queued message is replaced by the merged one instead, and when nothing can be
+            merged (merge returns None or no message with the same key) the reader blocks.
+            Messages for which inline(message) is true bypass the queue.
+        """
+        if policy not in self.policies:
+            raise ValueError(f"Unknown dispatch policy \"{policy}\". Expected one of {self.policies}.")
+        if workers < 1 or maxsize < 1:
+            raise ValueError("Dispatcher needs at least one worker and queue size of at least one.")
+        self.logger = logging.getLogger(__name__)
+        self.maxsize = maxsize
+        self.workers = workers
+        self.policy = policy
+        self.key = key
+        self.inline = inline
+        self.merge = merge
+        self.handler = None
+        self.shard_size = max(1, -(-maxsize // workers))
+        self.queues = [deque() for _ in range(workers)]
+        self.not_empty = [asyncio.Event() for _ in range(workers)]
+        self.not_full = [asyncio.Event() for _ in range(workers)]
+        self.idle = [asyncio.Event() for _ in range(workers)]
+        self.tasks = []
+        self.next_worker = 0
+        self.max_depth = 0
+        self.received = 0
+        self.dispatched = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.errors = 0
+        # puts waiting for free space with block policy, reader does not read socket meanwhile
+        self.blocked = 0
+        # observe_latency(seconds) is called with queue wait time of every dispatched message
+        self.observe_latency = None
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self.queues)
+
+    @property
+    def running(self) -> bool:
+        return len(self.tasks) > 0
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "maxsize": self.shard_size * self.workers,
+            "workers": self.workers,
+            "policy": self.policy,
+            "received": self.received,
+            "dispatched": self.dispatched,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "blocked": self.blocked,
+        }
+
+    def start(self, handler: typing.Callable):
+        if self.running:
+            return
+        self.handler = handler
+        loop = asyncio.get_running_loop()
+        for index in range(self.workers):
+            self.idle[index].set()
+            self.tasks.append(loop.create_task(self.__worker(index)))
+
+    async def stop(self, drain: bool = False):
+        if drain:
+            await self.join()
+        for task in self.tasks:
+            task.cancel()
+        for task in self.tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.tasks = []
+        for index in range(self.workers):
+            self.queues[index].clear()
+            self.not_full[index].set()
+
+    async def join(self):
+        for index in range(self.workers):
+            while self.queues[index] or not self.idle[index].is_set():
+                await self.idle[index].wait()
+                if self.queues[index]:
+                    await asyncio.sleep(0)
+
+    async def put(self, message: typing.Any):
+        self.received += 1
+        received_at = time.monotonic()
+        if self.inline is not None and self.inline(message):
+            await self.__handle(message, received_at)
+            return
+        key = self.key(message) if self.key is not None else None
+        if key is None:
+            index = self.next_worker
+            self.next_worker = (self.next_worker + 1) % self.workers
+        else:
+            index = hash(key) % self.workers
+        queue = self.queues[index]
+        while len(queue) >= self.shard_size:
+            if not self.running:
+                self.dropped += 1
+                return
+            if self.policy == self.COALESCE and key is not None:
+                position = self.__find_newest(queue, key)
+                if position >= 0:
+                    merged = message if self.merge is None else self.merge(queue[position][1], message)
+                    if merged is not None:
+                        # merged message keeps arrival time of the queued one
+                        queue[position] = (key, merged, queue[position][2])
+                        self.coalesced += 1
+                        return
+            if self.policy == self.BLOCK or (self.policy == self.COALESCE and self.merge is not None):
+                self.not_full[index].clear()
+                self.blocked += 1
+                try:
+                    await self.not_full[index].wait()
+                finally:
+                    self.blocked -= 1
+                continue
+            queue.popleft()
+            self.dropped += 1
+        queue.append((key, message, received_at))
+        self.max_depth = max(self.max_depth, self.depth)
+        self.not_empty[index].set()
+
+    @staticmethod
+    def __find_newest(queue, key):
+        for position in range(len(queue) - 1, -1, -1):
+            if queue[position][0] == key:
+                return position
+        return -1
+
+    async def __handle(self, message, received_at):
+        self.received_at.set(received_at)
+        try:
+            await self.handler(message)
+            self.dispatched += 1
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.errors += 1
+            self.logger.error(f"MessageDispatcher handler failed: {e!r}")
+
+    async def __worker(self, index: int):
+        queue = self.queues[index]
+        while True:
+            if not queue:
+                self.idle[index].set()
+                self.not_empty[index].clear()
+                await self.not_empty[index].wait()
+                continue
+            self.idle[index].clear()
+            key, message, queued_at = queue.popleft()
+            self.not_full[index].set()
+            if self.observe_latency is not None:
+                self.observe_latency(time.monotonic() - queued_at)
+            await self.__handle(message, queued_at)
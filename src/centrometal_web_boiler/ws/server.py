@@ -26,6 +26,14 @@ class ServerSocket(BaseSocket):
         self.loop.run_until_complete(self.server)
         self.loop.run_until_complete(asyncio.wait([coro() for coro in self.listeners.ready if type(coro) != tuple]))
         self.loop.run_forever()
+    async def serve(self, addr:str, port:int, **kwargs):
+        kwargs.pop('create_protocol', None)
+        self.address = addr
+        self.port = port
+        self.loop = asyncio.get_running_loop()
+        self.server = await websockets.serve(self.__main, addr, port, create_protocol = WSSProtocol, **kwargs)
+        await asyncio.gather(*[coro() for coro in self.listeners.ready if type(coro) != tuple])
+        return self.server
     async def on_message(self, message):
         pass
     async def __message_consumer(self, websocket):
@@ -37,19 +45,19 @@ class ServerSocket(BaseSocket):
                     data = message
                 message_cls: Message = Message(data=data, websocket=websocket, created_at=datetime.utcnow())
                 self.loop.create_task(asyncio.wait(
-                     [coro(message_cls) for coro in self.listeners.message]+[self.__collector_verifier(futures, 'message', message_cls) 
+                     [asyncio.create_task(coro(message_cls)) for coro in self.listeners.message]+[asyncio.create_task(self.__collector_verifier(futures, 'message', message_cls))
                      for futures in self.listeners.message_collector
                     ]))
         except ConnectionClosedError as e:
             self.clients.remove(websocket)
             self.disconnected_clients.append({websocket: Object({'code': e.code, 'reason': e.reason, 'disconnected': True})})
-            self.loop.create_task(asyncio.wait([coro(websocket, e.code, e.reason) for coro in self.listeners.disconnect]+[
-                     self.__collector_verifier(futures, 'disconnect', e.code, e.reason) 
+            self.loop.create_task(asyncio.wait([asyncio.create_task(coro(websocket, e.code, e.reason)) for coro in self.listeners.disconnect]+[
+                     asyncio.create_task(self.__collector_verifier(futures, 'disconnect', e.code, e.reason))
                      for futures in self.listeners.disconnect_collector
                     ]))
             return e
     async def __on_connect(self, client, path):
-        await asyncio.wait([coro(client, path) for coro in self.listeners.connect]+[self.__collector_verifier(futures, 'connect', client, path) 
+        await asyncio.wait([asyncio.create_task(coro(client, path)) for coro in self.listeners.connect]+[asyncio.create_task(self.__collector_verifier(futures, 'connect', client, path))
                      for futures in self.listeners.connect_collector
                     ])
     async def on_connect(self, client, path):
@@ -77,12 +85,12 @@ class ServerSocket(BaseSocket):
     async def __main(self, websocket, path):
         self.clients.append(websocket)
         self.loop.create_task(self.__on_connect(websocket, path))
-        done, pending = await asyncio.wait([self.__message_consumer(websocket)], return_when=asyncio.ALL_COMPLETED)
+        done, pending = await asyncio.wait([asyncio.create_task(self.__message_consumer(websocket))], return_when=asyncio.ALL_COMPLETED)
         if ConnectionClosedError in [type(ret.result()) for ret in done]: return
         self.clients.remove(websocket)
         self.disconnected_clients.append({websocket: Object({'code': websocket.close_code, 'reason': websocket.close_reason, 'disconnected': True})})
-        await asyncio.wait([coro(websocket, websocket.close_code, websocket.close_reason) for coro in self.listeners.close]+[
-                     self.__collector_verifier(futures, 'close', websocket, websocket.close_code, websocket.close_reason) 
+        await asyncio.wait([asyncio.create_task(coro(websocket, websocket.close_code, websocket.close_reason)) for coro in self.listeners.close]+[
+                     asyncio.create_task(self.__collector_verifier(futures, 'close', websocket, websocket.close_code, websocket.close_reason))
                      for futures in self.listeners.close_collector
                     ])
     async def send(self, client, content: typing.Any = None, *, data: dict = None):
@@ -0,0 +1,42 @@
+import asyncio
+
+from centrometal_web_boiler.WebBoilerClient import WebBoilerClient
+from centrometal_web_boiler.WebBoilerConfigurationCache import SNAPSHOT_RESPONSES, WebBoilerConfigurationCache
+from centrometal_web_boiler.WebBoilerMockServer import WebBoilerMockServer
+
+
+async def start_client(server, cache):
+    client = WebBoilerClient(webroot=server.webroot, stomp_url=server.stomp_url, configuration_cache=cache)
+    await client.login("mock", "mock")
+    assert await client.get_configuration()
+    if client.status_refresh_task is not None:
+        await client.status_refresh_task
+    return client
+
+
+async def start_cold_and_warm(path):
+    server = WebBoilerMockServer(devices=3, parameters=20, rate=0, http_port=18180, ws_port=18181)
+    await server.start()
+    try:
+        cache = WebBoilerConfigurationCache(str(path))
+        cold = await start_client(server, cache)
+        requests = server.http_requests
+        warm = await start_client(server, cache)
+        warm_requests = server.http_requests - requests
+        await cold.http_client.close_session()
+        await warm.http_client.close_session()
+        return cold, warm, warm_requests
+    finally:
+        await server.stop()
+
+
+def test_warm_start_equals_cold_start(tmp_path):
+    cold, warm, warm_requests = asyncio.run(start_cold_and_warm(tmp_path))
+    assert warm.data == cold.data
+    for serial, device in cold.data.items():
+        for key in ("temperatures", "info", "circuits", "widgets"):
+            assert list(warm.data[serial][key].keys()) == list(device[key].keys())
+    for name in SNAPSHOT_RESPONSES + ("grid",):
+        assert getattr(warm.http_client, name) == getattr(cold.http_client, name)
+    # login (2), installations validation and background status refresh only
+    assert warm_requests == 4
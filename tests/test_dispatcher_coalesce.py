@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+from centrometal_web_boiler.StompFrameParser import StompFrameParser
+from centrometal_web_boiler.WebBoilerWsClient import WebBoilerWsClient
+from centrometal_web_boiler.ws import MessageDispatcher
+
+
+def create_frame(serial, body):
+    body = json.dumps(body)
+    return (
+        "MESSAGE\n"
+        "subscription:sub-1\n"
+        f"destination:/topic/cm.inst.peltec.{serial}\n"
+        f"content-length:{len(body.encode())}\n"
+        "\n"
+        f"{body}\x00"
+    )
+
+
+async def dispatch(frames):
+    dispatcher = MessageDispatcher(maxsize=1, policy=MessageDispatcher.COALESCE, key=WebBoilerWsClient.get_frame_destination)
+    WebBoilerWsClient(None, None, None, None, dispatcher=dispatcher)
+    gate = asyncio.Event()
+    received = dict()
+
+    async def handler(message):
+        await gate.wait()
+        for frame in StompFrameParser().feed(message):
+            received.setdefault(frame["headers"]["destination"], dict()).update(json.loads(frame["body"]))
+
+    dispatcher.start(handler)
+    # first frame is taken by the worker, it waits at the gate while others queue up
+    await dispatcher.put(frames[0])
+    await asyncio.sleep(0)
+    puts = asyncio.gather(*[dispatcher.put(frame) for frame in frames[1:]])
+    await asyncio.sleep(0.05)
+    stats = dispatcher.stats()
+    gate.set()
+    await puts
+    await dispatcher.stop(drain=True)
+    return received, stats
+
+
+def test_coalesce_merges_partial_bodies():
+    frames = [
+        create_frame("SN1", {"B_Tk1": "20"}),
+        create_frame("SN1", {"B_Tk1": "21"}),
+        create_frame("SN1", {"B_P1": "1"}),
+        create_frame("SN1", {"B_fan": "1500"}),
+    ]
+    received, stats = asyncio.run(dispatch(frames))
+    assert received == {"/topic/cm.inst.peltec.SN1": {"B_Tk1": "21", "B_P1": "1", "B_fan": "1500"}}
+    assert stats["coalesced"] == 2
+    assert stats["dropped"] == 0
+
+
+def test_coalesce_blocks_instead_of_dropping_other_destination():
+    frames = [
+        create_frame("SN1", {"B_Tk1": "20"}),
+        create_frame("SN1", {"B_P1": "1"}),
+        create_frame("SN2", {"B_Tk1": "60"}),
+    ]
+    received, stats = asyncio.run(dispatch(frames))
+    assert received == {
+        "/topic/cm.inst.peltec.SN1": {"B_Tk1": "20", "B_P1": "1"},
+        "/topic/cm.inst.peltec.SN2": {"B_Tk1": "60"},
+    }
+    assert stats["blocked"] == 1
+    assert stats["dropped"] == 0
@@ -0,0 +1,45 @@
+import asyncio
+import time
+
+from centrometal_web_boiler.WebBoilerWsClient import WebBoilerWsClient
+
+
+class FakeRecorder:
+    def __init__(self):
+        self.timestamps = []
+
+    def record(self, data, timestamp = None):
+        self.timestamps.append(time.time() if timestamp is None else timestamp)
+
+
+def create_frame(index):
+    return (
+        "MESSAGE\n"
+        "subscription:sub-1\n"
+        "destination:/topic/cm.inst.peltec.SN1\n"
+        "\n"
+        f"{{\"B_Tk1\": \"{index}\"}}\x00"
+    )
+
+
+async def record_backlog(count, processing_time):
+    async def on_data(client, frame):
+        await asyncio.sleep(processing_time)
+
+    ws_client = WebBoilerWsClient(None, None, None, on_data)
+    ws_client.recorder = FakeRecorder()
+    ws_client.dispatcher.start(ws_client.client._ClientSocket__dispatch)
+    received = []
+    for index in range(count):
+        received.append(time.time())
+        await ws_client.dispatcher.put(create_frame(index))
+    await ws_client.dispatcher.stop(drain=True)
+    return received, ws_client.recorder.timestamps
+
+
+def test_recorded_timestamp_is_arrival_time():
+    received, recorded = asyncio.run(record_backlog(5, 0.05))
+    assert len(recorded) == 5
+    # last frame waited about 0.2 s in dispatch queue, recorded time must not include it
+    for arrival, timestamp in zip(received, recorded):
+        assert abs(timestamp - arrival) < 0.02
@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from centrometal_web_boiler.StompHeartbeat import StompHeartbeat
+
+
+class FakeClient:
+    def __init__(self):
+        self.last_received = 0
+        self.last_sent = 0
+        self.beats = []
+
+    async def send(self, data):
+        self.last_sent = time.monotonic()
+        self.beats.append(self.last_sent)
+
+    async def ping(self):
+        return 0.001
+
+
+async def collect_beats(duration):
+    client = FakeClient()
+
+    async def on_timeout():
+        pass
+
+    heartbeat = StompHeartbeat(client, on_timeout, send_interval=500, receive_interval=0)
+    heartbeat.start("0,500")
+    started = client.last_sent
+    await asyncio.sleep(duration)
+    heartbeat.stop()
+    return heartbeat.outgoing, [started] + client.beats
+
+
+def test_beats_are_sent_before_negotiated_interval_ends():
+    outgoing, beats = asyncio.run(collect_beats(2.5))
+    assert outgoing == 500
+    assert len(beats) >= 4
+    gaps = [later - earlier for earlier, later in zip(beats, beats[1:])]
+    assert max(gaps) < outgoing / 1000